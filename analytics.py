@@ -0,0 +1,260 @@
+"""Потоковая статистика опросов на счетчиках фиксированного размера.
+
+Каждое событие опроса (начало, ответ, некорректный ответ, отмена,
+завершение) увеличивает несколько ячеек массивов - сырые события не
+хранятся. Отчет собирается прямо из счетчиков: время не зависит от числа
+пользователей, только от числа вопросов и вариантов ответа.
+
+Для каждого опроса считаются:
+
+* воронка - сколько раз был показан каждый вопрос и сколько раз опрос на
+  нем отменили;
+* распределение ответов по каждому вопросу и доля некорректных ответов;
+* распределение итоговой суммы баллов.
+
+Счетчики периодически сохраняются в JSON-файл и загружаются при старте.
+В многопроцессном режиме у каждого воркера свой файл. Файлы других
+воркеров (``peers``) перечитываются в фоновом потоке по тому же таймеру,
+а отчет складывает их уже загруженные счетчики со своими.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+from array import array
+
+from sessions import MAX_QUESTIONS, MAX_SCORE
+
+logger = logging.getLogger(__name__)
+
+SCORE_SLOTS = MAX_SCORE + 1
+MAX_TOTAL = MAX_QUESTIONS * MAX_SCORE
+
+
+def _zeros(size):
+    return array('Q', bytes(8 * size))
+
+
+class QuizCounters:
+    __slots__ = ("title", "questions", "started", "completed",
+                 "reached", "answers", "invalid", "cancelled", "totals")
+
+    def __init__(self, title="", questions=0):
+        self.title = title
+        self.questions = questions
+        self.started = 0
+        self.completed = 0
+        self.reached = _zeros(MAX_QUESTIONS)  # сколько раз показан вопрос
+        self.answers = _zeros(MAX_QUESTIONS * SCORE_SLOTS)  # вопрос x балл
+        self.invalid = _zeros(MAX_QUESTIONS)
+        self.cancelled = _zeros(MAX_QUESTIONS)
+        self.totals = _zeros(MAX_TOTAL + 1)  # сумма баллов -> число завершений
+
+    _ARRAYS = ("reached", "answers", "invalid", "cancelled", "totals")
+
+    def to_dict(self):
+        data = {"title": self.title, "questions": self.questions,
+                "started": self.started, "completed": self.completed}
+        for name in self._ARRAYS:
+            data[name] = getattr(self, name).tolist()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        counters = cls(data.get("title", ""), data.get("questions", 0))
+        counters.started = data.get("started", 0)
+        counters.completed = data.get("completed", 0)
+        for name in cls._ARRAYS:
+            values = data.get(name, [])
+            target = getattr(counters, name)
+            if len(values) != len(target):
+                raise ValueError(f"Analytics snapshot field {name!r} has unexpected size")
+            target[:] = array('Q', values)
+        return counters
+
+    def add(self, other):
+        self.title = self.title or other.title
+        self.questions = max(self.questions, other.questions)
+        self.started += other.started
+        self.completed += other.completed
+        for name in self._ARRAYS:
+            target, source = getattr(self, name), getattr(other, name)
+            for i, value in enumerate(source):
+                if value:
+                    target[i] += value
+
+    def report(self):
+        questions = []
+        for i in range(self.questions):
+            row = self.answers[i * SCORE_SLOTS:(i + 1) * SCORE_SLOTS]
+            answered = sum(row)
+            attempts = answered + self.invalid[i]
+            questions.append({
+                "question": i + 1,
+                "reached": self.reached[i],
+                "answered": answered,
+                "cancelled": self.cancelled[i],
+                # Показан, но ответа так и не было: опрос брошен на этом вопросе
+                "dropped": max(0, self.reached[i] - answered - self.cancelled[i]),
+                "invalid": self.invalid[i],
+                "invalid_rate": round(self.invalid[i] / attempts, 4) if attempts else 0.0,
+                "answers": {score: count for score, count in enumerate(row) if count},
+            })
+        distribution = {total: count for total, count in enumerate(self.totals) if count}
+        mean = (
+            sum(total * count for total, count in distribution.items()) / self.completed
+            if self.completed else None
+        )
+        return {
+            "title": self.title,
+            "started": self.started,
+            "completed": self.completed,
+            "completion_rate": round(self.completed / self.started, 4) if self.started else 0.0,
+            "mean_score": round(mean, 2) if mean is not None else None,
+            "questions": questions,
+            "score_distribution": distribution,
+        }
+
+
+class QuizAnalytics:
+    def __init__(self, path=None, snapshot_interval=60.0, peers=None):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        # Функция, возвращающая пути снимков других воркеров
+        self.peers = peers
+        self._quizzes = {}  # id опроса -> QuizCounters
+        self._peer_quizzes = {}  # сумма снимков других воркеров на момент последнего таймера
+        self._task = None
+        self.snapshots = 0
+
+    def _counters(self, quiz):
+        counters = self._quizzes.get(quiz.id)
+        if counters is None:
+            counters = self._quizzes[quiz.id] = QuizCounters(quiz.title, len(quiz.questions))
+        elif counters.questions != len(quiz.questions) or counters.title != quiz.title:
+            # Опрос перезагружен с другим числом вопросов: отчет показывает их все
+            counters.questions = max(counters.questions, len(quiz.questions))
+            counters.title = quiz.title
+        return counters
+
+    # --- События ---
+
+    def started(self, quiz):
+        counters = self._counters(quiz)
+        counters.started += 1
+        counters.reached[0] += 1
+
+    def answered(self, quiz, index, score):
+        counters = self._counters(quiz)
+        counters.answers[index * SCORE_SLOTS + score] += 1
+        if index + 1 < len(quiz.questions):
+            counters.reached[index + 1] += 1
+
+    def invalid(self, quiz, index):
+        self._counters(quiz).invalid[index] += 1
+
+    def cancelled(self, quiz, index):
+        self._counters(quiz).cancelled[min(index, MAX_QUESTIONS - 1)] += 1
+
+    def completed(self, quiz, total):
+        counters = self._counters(quiz)
+        counters.completed += 1
+        counters.totals[min(total, MAX_TOTAL)] += 1
+
+    # --- Отчеты ---
+
+    def report(self):
+        """Отчет по всем опросам: свои счетчики плюс загруженные снимки других воркеров."""
+        if not self._peer_quizzes:
+            return {quiz_id: counters.report() for quiz_id, counters in self._quizzes.items()}
+        merged = merge_counters([self._peer_quizzes, self._quizzes])
+        return {quiz_id: counters.report() for quiz_id, counters in merged.items()}
+
+    # --- Снимки на диск ---
+
+    def load(self):
+        if self.peers:
+            self.refresh_peers()
+        if not self.path:
+            return
+        self._quizzes = load_snapshot(self.path)
+        if self._quizzes:
+            logger.info(f"Loaded analytics for {len(self._quizzes)} quizzes from {self.path}")
+
+    def refresh_peers(self):
+        """Перечитывает снимки других воркеров. Можно вызывать из другого потока."""
+        self._peer_quizzes = merge_counters(load_snapshot(path) for path in self.peers())
+
+    def snapshot(self):
+        if not self.path:
+            return
+        data = {"quizzes": {quiz_id: counters.to_dict() for quiz_id, counters in self._quizzes.items()}}
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w") as file:
+                json.dump(data, file)
+            os.replace(temporary, self.path)
+            self.snapshots += 1
+        except OSError as e:
+            logger.error(f"Could not save analytics snapshot {self.path}: {e}")
+
+    def start(self):
+        if (self.path or self.peers) and self.snapshot_interval > 0:
+            self._task = asyncio.create_task(self._run(), name="analytics-snapshot")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.snapshot()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            # Файл маленький (несколько КБ), запись не стоит переноса в поток
+            self.snapshot()
+            if self.peers:
+                # Чужих файлов может быть много - читаем и складываем их вне цикла событий
+                try:
+                    await asyncio.to_thread(self.refresh_peers)
+                except Exception as e:
+                    logger.error(f"Could not merge worker analytics snapshots: {e}", exc_info=True)
+
+
+def load_snapshot(path):
+    try:
+        with open(path) as file:
+            data = json.load(file)
+        return {
+            quiz_id: QuizCounters.from_dict(counters)
+            for quiz_id, counters in data.get("quizzes", {}).items()
+        }
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring unreadable analytics snapshot {path}: {e}")
+        return {}
+
+
+def merge_counters(sources):
+    """Складывает словари id опроса -> QuizCounters в новый словарь, не меняя исходные."""
+    merged = {}
+    for quizzes in sources:
+        for quiz_id, counters in quizzes.items():
+            target = merged.get(quiz_id)
+            if target is None:
+                target = merged[quiz_id] = QuizCounters()
+            target.add(counters)
+    return merged
+
+
+def worker_snapshot_path(path, index):
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker{index}{extension}"
+
+
+def worker_snapshot_paths(path):
+    root, extension = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(root)}.worker*{extension}"))
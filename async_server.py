@@ -0,0 +1,149 @@
+"""Асинхронный HTTP-сервер для вебхука на event loop бота.
+
+Работает на том же цикле событий, что и ``run_bot()``: запросы не уходят в
+потоки WSGI, а обновления попадают в приложение без межпоточной передачи.
+Tornado уже приходит вместе с ``python-telegram-bot[webhooks]``.
+"""
+import json
+import logging
+
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+class BaseJSONHandler(RequestHandler):
+    def reply(self, payload, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(payload, ensure_ascii=False))
+
+    # Необработанные ошибки - в общий логгер бота
+    def log_exception(self, typ, value, tb):
+        logger.error("Unhandled error in %s", self.request.path, exc_info=(typ, value, tb))
+
+
+class HealthHandler(BaseJSONHandler):
+    def initialize(self, payload_factory):
+        self.payload_factory = payload_factory
+
+    def get(self):
+        self.reply(self.payload_factory())
+
+
+class ProbeHandler(BaseJSONHandler):
+    """Проверка готовности или живости: ``check()`` возвращает (ok, payload), при ok=False - 503."""
+
+    def initialize(self, check):
+        self.check = check
+
+    def get(self):
+        ok, payload = self.check()
+        self.reply(payload, 200 if ok else 503)
+
+
+class AnalyticsHandler(BaseJSONHandler):
+    def initialize(self, payload_factory, token):
+        self.payload_factory = payload_factory
+        self.token = token
+
+    def get(self):
+        if not self.token or self.request.headers.get('X-Analytics-Token') != self.token:
+            return self.reply({"status": "forbidden"}, 403)
+        self.reply(self.payload_factory())
+
+
+class MetricsHandler(RequestHandler):
+    def initialize(self, render):
+        self.render_metrics = render
+
+    def get(self):
+        self.set_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.finish(self.render_metrics())
+
+
+class WebhookHandler(BaseJSONHandler):
+    def initialize(self, secret_token, on_update, accepting=None):
+        self.secret_token = secret_token
+        self.on_update = on_update
+        self.accepting = accepting
+
+    async def post(self):
+        secret_token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token')
+        if secret_token != self.secret_token:
+            logger.warning("Invalid secret token received")
+            return self.reply({"status": "forbidden"}, 403)
+
+        try:
+            json_data = json.loads(self.request.body or b"null")
+        except ValueError:
+            logger.warning("Malformed JSON received")
+            return self.reply({"status": "bad request"}, 400)
+
+        if not json_data:
+            logger.warning("Empty JSON data received")
+            return self.reply({"status": "bad request"}, 400)
+
+        # Бот еще запускается или уже останавливается - Telegram повторит доставку
+        if self.accepting and not self.accepting():
+            return self.reply({"status": "unavailable"}, 503)
+
+        # Обновление только ставится в очередь, обработка идет уже после ответа
+        if not await self.on_update(json_data):
+            logger.warning("Update queue is full, asking Telegram to retry later")
+            return self.reply({"status": "overloaded"}, 503)
+
+        self.reply({"status": "ok"})
+
+
+def build_web_app(secret_token, on_update, health_payload, home_payload,
+                  metrics_payload=None, on_webhook_done=None, analytics_payload=None, analytics_token="",
+                  accepting=None, readiness=None, liveness=None):
+    routes = [
+        (r"/webhook", WebhookHandler,
+         {"secret_token": secret_token, "on_update": on_update, "accepting": accepting}),
+        (r"/health", HealthHandler, {"payload_factory": health_payload}),
+        (r"/", HealthHandler, {"payload_factory": home_payload}),
+    ]
+    if readiness:
+        routes.append((r"/health/ready", ProbeHandler, {"check": readiness}))
+    if liveness:
+        routes.append((r"/health/live", ProbeHandler, {"check": liveness}))
+    if metrics_payload:
+        routes.append((r"/metrics", MetricsHandler, {"render": metrics_payload}))
+    if analytics_payload:
+        routes.append((r"/analytics", AnalyticsHandler,
+                       {"payload_factory": analytics_payload, "token": analytics_token}))
+
+    def log_function(handler):
+        # Вместо access-лога Tornado - только метрики вебхука
+        if on_webhook_done and isinstance(handler, WebhookHandler):
+            on_webhook_done(handler.get_status(), handler.request.request_time())
+
+    return WebApplication(routes, log_function=log_function)
+
+
+async def start_async_server(port, secret_token, on_update, health_payload, home_payload,
+                             metrics_payload=None, on_webhook_done=None, analytics_payload=None,
+                             analytics_token="", accepting=None, readiness=None, liveness=None,
+                             host='0.0.0.0'):
+    """Запускает сервер на текущем event loop и возвращает ``HTTPServer``.
+
+    ``on_update`` - корутина, принимающая уже декодированный JSON обновления;
+    если она вернула False, обновление не принято и клиент получает 503.
+    ``on_webhook_done(status, seconds)`` вызывается после каждого запроса к /webhook.
+    /analytics требует ``analytics_token`` в заголовке X-Analytics-Token; без токена отвечает 403.
+    Пока ``accepting()`` возвращает False, /webhook отвечает 503; ``readiness`` и
+    ``liveness`` обслуживают /health/ready и /health/live.
+    """
+    web_app = build_web_app(
+        secret_token, on_update, health_payload, home_payload, metrics_payload, on_webhook_done,
+        analytics_payload, analytics_token, accepting, readiness, liveness
+    )
+    server = HTTPServer(web_app, xheaders=True, idle_connection_timeout=75)
+    server.listen(port, address=host, backlog=2048)
+    logger.info(f"Async webhook server listening on {host}:{port}")
+    return server
@@ -0,0 +1,103 @@
+"""Микробенчмарк маршрутизации текстов кнопок.
+
+Сравнивает прежнюю цепочку ``filters.Regex`` и разбор ответа через
+``split()``/``isdigit()`` с поиском по хеш-таблицам из ``routing.py``::
+
+    python -m bench.dispatch_bench --iterations 200000
+"""
+import argparse
+import json
+import timeit
+
+from telegram import Update
+from telegram.ext import MessageHandler, filters
+
+import bot
+from routing import ExactTextFilter
+
+TEXTS = [
+    "Начать тест 🚀", "О курсе ℹ️", "Проверить бота ✅",
+    "1 😞", "3 😊", "5 🤩", "просто текст", "4",
+]
+
+
+def make_update(text, update_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }, None)
+
+
+async def _noop(update, context):
+    pass
+
+
+def regex_chain():
+    return [
+        MessageHandler(filters.Regex("^Начать тест 🚀$"), _noop),
+        MessageHandler(filters.Regex("^О курсе ℹ️$"), _noop),
+        MessageHandler(filters.Regex("^Проверить бота ✅$"), _noop),
+        MessageHandler(filters.TEXT & ~filters.COMMAND, _noop),
+    ]
+
+
+def exact_chain():
+    return [
+        MessageHandler(ExactTextFilter([bot.START_BUTTON]), _noop),
+        MessageHandler(ExactTextFilter(["О курсе ℹ️", "Проверить бота ✅"]), _noop),
+        MessageHandler(filters.TEXT & ~filters.COMMAND, _noop),
+    ]
+
+
+def dispatch(handlers, updates):
+    for update in updates:
+        for handler in handlers:
+            if handler.check_update(update):
+                break
+
+
+def legacy_parse(text):
+    answer = text.split()[0]
+    if not answer.isdigit() or int(answer) < 1 or int(answer) > 5:
+        return None
+    return int(answer)
+
+
+def measure(func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=5))
+    return round(seconds / iterations * 1e9, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Button text dispatch micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    updates = [make_update(text, i) for i, text in enumerate(TEXTS, 1)]
+    regex_handlers, exact_handlers = regex_chain(), exact_chain()
+    answers = [text for text in TEXTS if text.strip()]
+    quiz = bot.quiz_registry.get(bot.DEFAULT_QUIZ)
+
+    result = {
+        "iterations": args.iterations,
+        "texts": len(TEXTS),
+        "dispatch_ns_per_batch": {
+            "regex_chain": measure(lambda: dispatch(regex_handlers, updates), args.iterations),
+            "exact_text": measure(lambda: dispatch(exact_handlers, updates), args.iterations),
+        },
+        "parse_answer_ns_per_batch": {
+            "split_isdigit": measure(lambda: [legacy_parse(text) for text in answers], args.iterations),
+            "score_table": measure(lambda: [quiz.parse_answer(text) for text in answers], args.iterations),
+        },
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Поддерживает методы, которые вызывает бот: ``getMe``, ``getWebhookInfo``,
+``setWebhook``, ``deleteWebhook``, ``setMyCommands``, ``getMyCommands``,
+``sendMessage``, ``editMessageText``, ``answerCallbackQuery``. Задержка
+ответа и доля ответов 429 настраиваются. Все отправленные ботом сообщения
+запоминаются по чатам, чтобы генератор нагрузки мог дождаться ответа.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+# Методы, которые отправляют сообщение в чат и на которые действуют флуд-лимиты
+MESSAGE_METHODS = frozenset(("sendMessage", "editMessageText"))
+
+
+class SentMessage:
+    __slots__ = ("received_at", "method", "text", "reply_markup")
+
+    def __init__(self, received_at, method, text, reply_markup):
+        self.received_at = received_at
+        self.method = method
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.webhook = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        self.commands = []
+        self.messages = defaultdict(list)  # chat_id -> [SentMessage]
+        self.calls = Counter()
+        self.flood_errors = 0
+        self.blocked_chats = set()  # чаты, где бот "заблокирован": ответ 403
+        self._message_ids = defaultdict(int)
+        self._waiters = defaultdict(list)  # chat_id -> [(predicate, future)]
+        self._server = None
+
+    # --- Ожидание ответов бота ---
+
+    def wait_for(self, chat_id, predicate, since, timeout):
+        """Ждет сообщение в чат, пришедшее не раньше ``since`` и удовлетворяющее ``predicate``."""
+        for message in reversed(self.messages[chat_id]):
+            if message.received_at < since:
+                break
+            if predicate(message):
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(message)
+                return asyncio.wait_for(future, timeout)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return asyncio.wait_for(future, timeout)
+
+    def _record(self, chat_id, method, params):
+        message = SentMessage(
+            time.perf_counter(), method, params.get("text", ""),
+            json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        )
+        self.messages[chat_id].append(message)
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            remaining = []
+            for predicate, future in waiters:
+                if future.done():
+                    continue
+                if predicate(message):
+                    future.set_result(message)
+                else:
+                    remaining.append((predicate, future))
+            self._waiters[chat_id] = remaining
+
+    # --- Методы Bot API ---
+
+    def call(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getWebhookInfo":
+            return self.webhook
+        if method == "setWebhook":
+            allowed = params.get("allowed_updates")
+            if isinstance(allowed, str):
+                allowed = json.loads(allowed)
+            self.webhook = dict(self.webhook, url=params.get("url", ""), allowed_updates=allowed or [])
+            return True
+        if method == "deleteWebhook":
+            self.webhook = dict(self.webhook, url="")
+            return True
+        if method == "setMyCommands":
+            self.commands = json.loads(params.get("commands", "[]"))
+            return True
+        if method == "getMyCommands":
+            return self.commands
+        if method == "answerCallbackQuery":
+            return True
+        if method in MESSAGE_METHODS:
+            chat_id = int(params["chat_id"])
+            self._record(chat_id, method, params)
+            if method == "editMessageText":
+                message_id = int(params["message_id"])
+            else:
+                self._message_ids[chat_id] += 1
+                message_id = self._message_ids[chat_id]
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return None
+
+    def stats(self):
+        return {"calls": dict(self.calls), "flood_errors": self.flood_errors}
+
+    # --- HTTP ---
+
+    def build_app(self):
+        return WebApplication([(r"/bot[^/]+/(\w+)", _MethodHandler, {"fake": self})])
+
+    async def start(self, port, host="127.0.0.1"):
+        self._server = HTTPServer(self.build_app())
+        self._server.listen(port, address=host)
+
+    def stop(self):
+        if self._server:
+            self._server.stop()
+
+
+class _MethodHandler(RequestHandler):
+    def initialize(self, fake):
+        self.fake = fake
+
+    async def post(self, method):
+        fake = self.fake
+        fake.calls[method] += 1
+        if fake.latency or fake.jitter:
+            await asyncio.sleep(fake.latency + random.random() * fake.jitter)
+
+        if method in MESSAGE_METHODS and fake.error_rate and random.random() < fake.error_rate:
+            fake.flood_errors += 1
+            self.set_status(429)
+            return self.finish({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {fake.retry_after}",
+                "parameters": {"retry_after": fake.retry_after},
+            })
+
+        params = {key: values[-1].decode() for key, values in self.request.body_arguments.items()}
+        if not params and self.request.body:
+            params = json.loads(self.request.body)
+        if method in MESSAGE_METHODS and int(params.get("chat_id", 0)) in fake.blocked_chats:
+            self.set_status(403)
+            return self.finish({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"
+            })
+        result = fake.call(method, params)
+        if result is None:
+            self.set_status(404)
+            return self.finish({"ok": False, "error_code": 404, "description": "Not Found"})
+        self.finish(json.dumps({"ok": True, "result": result}))
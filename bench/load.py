@@ -0,0 +1,132 @@
+"""Генератор синтетических вебхуков: проводит пользователей через весь опрос.
+
+Каждый виртуальный пользователь отправляет ``/start``, затем 5 ответов
+(иногда - некорректный ответ перед правильным) и ждет результат. Задержка
+каждого шага - время от POST на ``/webhook`` до получения заглушкой Bot API
+нужного сообщения от бота.
+"""
+import asyncio
+import itertools
+import random
+import time
+
+import httpx
+
+ANSWERS = ["1 😞", "2 😐", "3 😊", "4 😃", "5 🤩"]
+INVALID_ANSWERS = ["не знаю", "7", "ноль", "🙂"]
+QUESTION_COUNT = 5
+RESULT_MARKER = "Ваши результаты"
+
+# update_id общий для всех генераторов одного прогона, иначе бот отсеет их как повторы
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def question_marker(index):
+    # Вопросы отправляются с Markdown: "*1.* *Текст*"
+    return f"*{index + 1}.*"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    position = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[position]
+
+
+class LoadGenerator:
+    def __init__(self, fake, webhook_url, secret_token, users=1000, concurrency=200,
+                 invalid_rate=0.1, step_timeout=30.0, first_user_id=500000000):
+        self.fake = fake
+        self.webhook_url = webhook_url
+        self.secret_token = secret_token
+        self.users = users
+        self.concurrency = concurrency
+        self.invalid_rate = invalid_rate
+        self.step_timeout = step_timeout
+        self.first_user_id = first_user_id
+
+        self.latencies = []
+        self.updates_sent = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.completed = 0
+
+    def _update(self, user_id, text):
+        message = {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(_update_ids), "message": message}
+
+    async def _step(self, client, user_id, text, marker):
+        sent_at = time.perf_counter()
+        response = await client.post(
+            self.webhook_url,
+            json=self._update(user_id, text),
+            headers={"X-Telegram-Bot-Api-Secret-Token": self.secret_token}
+        )
+        self.updates_sent += 1
+        if response.status_code == 503:
+            self.rejected += 1
+            raise RuntimeError("webhook overloaded")
+        response.raise_for_status()
+        message = await self.fake.wait_for(
+            user_id, lambda m: marker in m.text, sent_at, self.step_timeout
+        )
+        self.latencies.append(message.received_at - sent_at)
+
+    async def run_user(self, client, user_id, stop_after=None):
+        """Проходит опрос; ``stop_after`` - на каком вопросе остановиться (для замера памяти)."""
+        await self._step(client, user_id, "/start", question_marker(0))
+        for index in range(QUESTION_COUNT):
+            if index == stop_after:
+                return
+            if random.random() < self.invalid_rate:
+                await self._step(client, user_id, random.choice(INVALID_ANSWERS), question_marker(index))
+            next_marker = question_marker(index + 1) if index + 1 < QUESTION_COUNT else RESULT_MARKER
+            await self._step(client, user_id, random.choice(ANSWERS), next_marker)
+        self.completed += 1
+
+    async def run(self, user_ids, stop_after=None):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+
+        async with httpx.AsyncClient(limits=limits, timeout=self.step_timeout) as client:
+            async def guarded(user_id):
+                async with semaphore:
+                    try:
+                        await self.run_user(client, user_id, stop_after)
+                    except asyncio.TimeoutError:
+                        self.timeouts += 1
+                    except Exception:
+                        self.errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(guarded(user_id) for user_id in user_ids))
+            return time.perf_counter() - started
+
+    def report(self, duration):
+        latencies = sorted(self.latencies)
+        return {
+            "duration_s": round(duration, 3),
+            "updates_sent": self.updates_sent,
+            "throughput_updates_per_s": round(self.updates_sent / duration, 2) if duration else 0.0,
+            "completed_quizzes": self.completed,
+            "quizzes_per_s": round(self.completed / duration, 2) if duration else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99": round(percentile(latencies, 0.99) * 1000, 2),
+                "max": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+            },
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
@@ -0,0 +1,202 @@
+"""Нагрузочный тест бота с локальной заглушкой Bot API.
+
+Запуск из корня репозитория::
+
+    python -m bench.run --users 2000 --concurrency 300 --output bench_result.json
+
+Скрипт поднимает заглушку Bot API, запускает ``bot.py`` отдельным процессом,
+направленным на нее, и прогоняет два этапа:
+
+1. ``memory`` - пользователи начинают опрос и останавливаются на середине;
+   по приросту RSS процесса бота оценивается память на активную сессию;
+2. ``load`` - другие пользователи проходят опрос целиком, включая
+   некорректные ответы; измеряются пропускная способность и задержки.
+
+Результат печатается и сохраняется в JSON, чтобы сравнивать прогоны.
+Бот работает во временном каталоге, и все его файлы состояния (кэш
+запуска, статистика, базы) пишутся туда, а не в рабочие файлы репозитория.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.fake_telegram import FakeTelegram
+from bench.load import LoadGenerator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_TOKEN = "bench-secret"
+
+
+def read_rss(pid):
+    """RSS процесса в байтах (Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+async def wait_until_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Bot did not become ready at {url}")
+
+
+def bot_environment(args, state_dir):
+    env = dict(os.environ)
+    env.update({
+        # Пути задаются явно, чтобы не достались из окружения запускающего
+        "STATE_DB_PATH": os.path.join(state_dir, "bot_state.sqlite3"),
+        "ANALYTICS_PATH": os.path.join(state_dir, "bot_analytics.json"),
+        "BROADCAST_DB_PATH": os.path.join(state_dir, "bot_broadcast.sqlite3"),
+        "STARTUP_CACHE_PATH": os.path.join(state_dir, "bot_startup_cache.json"),
+        "TELEGRAM_BOT_TOKEN": "123456:BENCH",
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{args.api_port}/bot",
+        "WEBHOOK_URL": f"http://127.0.0.1:{args.bot_port}",
+        "PORT": str(args.bot_port),
+        "SECRET_TOKEN": SECRET_TOKEN,
+        "SERVER_MODE": args.server_mode,
+        "STATE_BACKEND": "memory",
+        # Лимиты Telegram здесь не нужны - меряется сам бот, а не планировщик отправки
+        "OUTBOUND_GLOBAL_RATE": "100000",
+        "OUTBOUND_CHAT_RATE": "1000",
+        "OUTBOUND_CHAT_BURST": "1000",
+    })
+    for item in args.bot_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def run(args):
+    fake = FakeTelegram(
+        latency=args.api_latency_ms / 1000,
+        jitter=args.api_jitter_ms / 1000,
+        error_rate=args.flood_rate,
+        retry_after=args.retry_after
+    )
+    await fake.start(args.api_port)
+
+    state_dir = tempfile.mkdtemp(prefix="quiz-bench-")
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bot.py")],
+        cwd=state_dir,
+        env=bot_environment(args, state_dir),
+        stdout=subprocess.DEVNULL if not args.bot_logs else None,
+        stderr=subprocess.DEVNULL if not args.bot_logs else None
+    )
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{args.bot_port}/health/ready")
+        webhook_url = f"http://127.0.0.1:{args.bot_port}/webhook"
+        rss_baseline = read_rss(process.pid)
+
+        memory_users = LoadGenerator(
+            fake, webhook_url, SECRET_TOKEN, concurrency=args.concurrency,
+            invalid_rate=0.0, step_timeout=args.step_timeout
+        )
+        await memory_users.run(
+            range(memory_users.first_user_id, memory_users.first_user_id + args.memory_users),
+            stop_after=2
+        )
+        rss_active = read_rss(process.pid)
+
+        load = LoadGenerator(
+            fake, webhook_url, SECRET_TOKEN, concurrency=args.concurrency,
+            invalid_rate=args.invalid_rate, step_timeout=args.step_timeout,
+            first_user_id=700000000
+        )
+        duration = await load.run(range(load.first_user_id, load.first_user_id + args.users))
+
+        async with httpx.AsyncClient() as client:
+            health = (await client.get(f"http://127.0.0.1:{args.bot_port}/health")).json()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fake.stop()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    active_sessions = args.memory_users - memory_users.timeouts - memory_users.errors
+    result = {
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "invalid_rate": args.invalid_rate,
+            "server_mode": args.server_mode,
+            "api_latency_ms": args.api_latency_ms,
+            "api_jitter_ms": args.api_jitter_ms,
+            "flood_rate": args.flood_rate,
+            "bot_env": args.bot_env,
+        },
+        "load": load.report(duration),
+        "memory": {
+            "rss_baseline_bytes": rss_baseline,
+            "rss_active_bytes": rss_active,
+            "active_sessions": active_sessions,
+            "bytes_per_active_session": (
+                round((rss_active - rss_baseline) / active_sessions)
+                if rss_baseline and rss_active and active_sessions > 0 else None
+            ),
+        },
+        "fake_api": fake.stats(),
+        "bot_health": health,
+    }
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the quiz bot against a fake Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="users completing the full quiz")
+    parser.add_argument("--memory-users", type=int, default=1000,
+                        help="users left mid-quiz to measure memory per session")
+    parser.add_argument("--concurrency", type=int, default=200, help="simultaneously active users")
+    parser.add_argument("--invalid-rate", type=float, default=0.1,
+                        help="probability of an invalid answer before each valid one")
+    parser.add_argument("--server-mode", choices=("flask", "async"), default="async")
+    parser.add_argument("--api-latency-ms", type=float, default=20.0, help="fake Bot API latency")
+    parser.add_argument("--api-jitter-ms", type=float, default=10.0, help="random extra latency")
+    parser.add_argument("--flood-rate", type=float, default=0.0,
+                        help="share of sendMessage calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after for injected 429s")
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--api-port", type=int, default=18081)
+    parser.add_argument("--bot-port", type=int, default=18080)
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the bot process, may be repeated")
+    parser.add_argument("--bot-logs", action="store_true", help="show bot process output")
+    parser.add_argument("--output", help="write the JSON result to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
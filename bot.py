@@ -1,201 +1,730 @@
 import os
+import atexit
 import logging
+import signal
 import threading
-import requests
+import functools
 import time
-from flask import Flask, jsonify, request
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
+# Отсчет времени холодного старта (до импорта тяжелых зависимостей)
+BOOT_STARTED = time.perf_counter()
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    KeyboardButton
+)
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     filters,
     ContextTypes,
     ConversationHandler
 )
+from telegram.error import NetworkError, RetryAfter
+from telegram.warnings import PTBUserWarning
 import asyncio
+import warnings
+from analytics import QuizAnalytics, worker_snapshot_path, worker_snapshot_paths
+from broadcast import BroadcastEngine, BroadcastStore
+from cache import AsyncTTLCache
+from dedup import UpdateDeduplicator
+from http_client import HttpStats, InstrumentedHTTPXRequest, build_async_client
+from logs import HOT, LogPipeline, bind_update, unbind_update
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from outbound import OutboundScheduler, PRIORITY_NOTIFICATION, PRIORITY_QUIZ
+from quiz_engine import INLINE_ANSWER_PATTERN, QuizRegistry
+from routing import ExactTextFilter, build_text_routes
+from scheduler import ChatOrderedScheduler
+from sessions import (
+    QUIZ_REF_KEY,
+    SessionManager,
+    add_answer,
+    clear_quiz_state,
+    has_quiz_state,
+    question_index,
+    quiz_state,
+    store_quiz_state,
+    total_score
+)
+from startup import StartupCache, fingerprint
+from storage import WriteBehindPersistence, create_backend
 
 # Конфигурация
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '7292601652:AAFAv9wtDXK_2CI3zHGu9RCHQsvPCfzwjUE')
 PORT = int(os.environ.get('PORT', 10000))
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'https://qa-polls-bot.onrender.com')
 SECRET_TOKEN = os.getenv('SECRET_TOKEN', 'your_secret_token_here')
+# Адрес Bot API; переопределяется, например, для нагрузочного теста с локальной заглушкой
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
 BOT_NAME = "@QaPollsBot"
 TG_LINK = "https://t.me/Dmitrii_Fursa8"
 VK_LINK = "https://m.vk.com/id119459855"
+# Режим HTTP-сервера: 'flask' (потоки WSGI) или 'async' (Tornado на event loop бота)
+SERVER_MODE = os.getenv('SERVER_MODE', 'flask').lower()
+# Сколько чатов обрабатывается параллельно и сколько обновлений может ждать в очереди
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 16))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))
+# При переполнении: 'wait' - подождать ENQUEUE_TIMEOUT секунд, 'reject' - сразу ответить 503
+OVERFLOW_POLICY = os.getenv('OVERFLOW_POLICY', 'wait').lower()
+ENQUEUE_TIMEOUT = float(os.getenv('ENQUEUE_TIMEOUT', 2.0))
+# Сколько последних update_id помнить для отсева повторных доставок
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 4096))
+# Лимиты Telegram для исходящих сообщений: всего в секунду и в один чат
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+# Склеивать идущие подряд сообщения в один чат
+OUTBOUND_COALESCE = os.getenv('OUTBOUND_COALESCE', '1') == '1'
+# Исходящие HTTP-запросы: размер пула, время жизни keep-alive соединения, таймауты, версия HTTP
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 32))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+HTTP_WRITE_TIMEOUT = float(os.getenv('HTTP_WRITE_TIMEOUT', 10))
+HTTP_POOL_TIMEOUT = float(os.getenv('HTTP_POOL_TIMEOUT', 5))
+HTTP_VERSION = os.getenv('HTTP_VERSION', '1.1')
+KEEP_ALIVE_INTERVAL = float(os.getenv('KEEP_ALIVE_INTERVAL', 300))
+# Режим опроса: 'reply' (вопрос - новое сообщение с обычной клавиатурой)
+# или 'inline' (одно сообщение с inline-кнопками, которое редактируется)
+QUIZ_MODE = os.getenv('QUIZ_MODE', 'reply').lower()
+# Каталог с определениями опросов, опрос по умолчанию (/start и кнопка "Начать тест")
+# и как часто проверять файлы на изменения (0 - не перезагружать на ходу)
+QUIZ_DIR = os.getenv('QUIZ_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quizzes'))
+DEFAULT_QUIZ = os.getenv('DEFAULT_QUIZ', 'qa')
+QUIZ_RELOAD_INTERVAL = float(os.getenv('QUIZ_RELOAD_INTERVAL', 5))
+# Хранилище состояния опросов: 'sqlite', 'memory' или 'none' (только память без persistence)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite').lower()
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'bot_state.sqlite3')
+# Изменения сбрасываются на диск пачкой раз в STATE_FLUSH_INTERVAL секунд или по STATE_BATCH_SIZE записей
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', 2.0))
+STATE_BATCH_SIZE = int(os.getenv('STATE_BATCH_SIZE', 200))
+# Сколько секунд кэшировать getMe и getWebhookInfo для /status и /health
+BOT_INFO_TTL = float(os.getenv('BOT_INFO_TTL', 3600))
+WEBHOOK_INFO_TTL = float(os.getenv('WEBHOOK_INFO_TTL', 30))
+# Статистика опросов: файл снимка и как часто его сохранять (секунды)
+ANALYTICS_PATH = os.getenv('ANALYTICS_PATH', 'bot_analytics.json')
+ANALYTICS_SNAPSHOT_INTERVAL = float(os.getenv('ANALYTICS_SNAPSHOT_INTERVAL', 60))
+# Кому доступна команда /stats (id пользователей через запятую) и токен для /analytics
+# (без токена /analytics закрыт)
+ADMIN_IDS = frozenset(int(user_id) for user_id in os.getenv('ADMIN_IDS', '').replace(',', ' ').split())
+ANALYTICS_TOKEN = os.getenv('ANALYTICS_TOKEN', '')
+# Рассылки: база получателей, сколько сообщений в полете и скорость (сообщений/с).
+# Скорость должна оставлять запас до OUTBOUND_GLOBAL_RATE для ответов опроса.
+BROADCAST_DB_PATH = os.getenv('BROADCAST_DB_PATH', 'bot_broadcast.sqlite3')
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 5))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+# Файл с последними известными данными бота и параметрами вебхука - для быстрого старта
+STARTUP_CACHE_PATH = os.getenv('STARTUP_CACHE_PATH', 'bot_startup_cache.json')
+# Сессии опроса: через сколько секунд бездействия опрос завершается, сколько сессий
+# держать в памяти и сколько памяти (МБ) они могут занимать; SESSION_MEMORY_MB=0 - без лимита
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', 1800))
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', 50000))
+SESSION_MEMORY_MB = float(os.getenv('SESSION_MEMORY_MB', 64))
+# Сверх лимитов прерываются только опросы, в которых не отвечали хотя бы столько секунд
+SESSION_MIN_IDLE = float(os.getenv('SESSION_MIN_IDLE', 300))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 30))
+# Число процессов-воркеров. При WORKERS > 1 основной процесс только принимает
+# вебхуки и раскладывает их по воркерам по chat_id
+WORKERS = int(os.getenv('WORKERS', 1))
+# Как часто воркер сохраняет состояние и подтверждает фронту обработанные обновления
+WORKER_COMMIT_INTERVAL = float(os.getenv('WORKER_COMMIT_INTERVAL', 0.2))
+# Сколько секунд после SIGTERM дорабатывать принятые обновления и исходящие сообщения
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 25))
+# Воркерам нужно общее хранилище: состояние должно пережить перезапуск процесса
+if WORKERS > 1:
+    STATE_BACKEND = 'sqlite'
+
+# Логи: формат text или json и уровень
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Очередь фоновой записи логов (0 - писать сразу из обработчика)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Какая доля частых сообщений об отдельных обновлениях попадает в лог (предупреждения и ошибки - всегда)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
 
 # Настройка логирования
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+log_pipeline = LogPipeline(
+    log_format=LOG_FORMAT,
+    level=LOG_LEVEL,
+    queue_size=LOG_QUEUE_SIZE,
+    sample_rate=LOG_SAMPLE_RATE,
+    # Строка access-лога Flask на каждый запрос
+    hot_loggers=("werkzeug",)
+).start()
+atexit.register(log_pipeline.stop)
+# Строка на каждый запрос к Bot API; время запросов и так есть в /metrics
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Создаем Flask приложение
-app = Flask(__name__)
-
 # Глобальная переменная для хранения приложения Telegram
 telegram_application = None  # Переименовали для избежания конфликта имен
+# Event loop, на котором работает бот (задается в run_bot)
+bot_loop = None
+# Планировщик обработки обновлений (создается в run_bot)
+update_scheduler = None
+# Принимает ли вебхук обновления (после запуска планировщика и до начала остановки)
+accepting_updates = False
+# Идет ли остановка по SIGTERM; stop_requested создается в run_bot
+draining = False
+stop_requested = None
+# Метрики для /metrics
+metrics_registry = Registry()
+webhook_requests_total = metrics_registry.counter(
+    "bot_webhook_requests_total", "Webhook requests by HTTP status", ("status",)
+)
+webhook_request_seconds = metrics_registry.histogram(
+    "bot_webhook_request_seconds", "Time to answer a webhook request"
+)
+update_seconds = metrics_registry.histogram(
+    "bot_update_seconds", "Time from webhook receipt to the end of process_update"
+)
+handler_seconds = metrics_registry.histogram(
+    "bot_handler_seconds", "Handler callback latency", ("handler",)
+)
+bot_api_seconds = metrics_registry.histogram(
+    "bot_api_request_seconds", "Outbound HTTP request latency by Bot API method", ("method",)
+)
+bot_api_errors_total = metrics_registry.counter(
+    "bot_api_errors_total", "Failed outbound HTTP requests by Bot API method", ("method",)
+)
+
+def record_http_request(endpoint, seconds, error):
+    bot_api_seconds.labels(endpoint).observe(seconds)
+    if error:
+        bot_api_errors_total.labels(endpoint).inc()
+
+def record_webhook_request(status, seconds):
+    webhook_requests_total.labels(status).inc()
+    webhook_request_seconds.observe(seconds)
+
+def timed_handler(callback):
+    """Декоратор обработчика: пишет время его выполнения в bot_handler_seconds."""
+    histogram = handler_seconds.labels(callback.__name__)
+    
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+# Статистика исходящих HTTP-запросов (Bot API и self-ping)
+http_stats = HttpStats(observer=record_http_request)
+# Фоновые задачи на event loop бота
+background_tasks = set()
+# Планировщик исходящих сообщений (создается в run_bot)
+outbound = None
+# Persistence состояния опросов (создается в create_telegram_app)
+state_persistence = None
+quiz_conversation = None
+# Счетчики статистики опросов (файл снимка задается в run_bot)
+quiz_analytics = QuizAnalytics(snapshot_interval=ANALYTICS_SNAPSHOT_INTERVAL)
+# Разговор опроса и учет его сессий (создаются в create_telegram_app и run_bot)
+session_manager = None
+# Рассылки участникам опросов (создаются в run_bot)
+broadcasts = None
+# Последние принятые update_id - для отсева повторных доставок
+update_deduplicator = UpdateDeduplicator(DEDUP_WINDOW)
+webhook_stats = {"dropped": 0, "failed": 0}
+# Данные бота и вебхука из Bot API с TTL
+bot_metadata = AsyncTTLCache({"me": BOT_INFO_TTL, "webhook_info": WEBHOOK_INFO_TTL})
+# Секунды от старта процесса до готовности и до первого обработанного обновления
+startup_stats = {"ready_s": None, "first_reply_s": None}
+
+metrics_registry.callback(
+    "bot_updates_in_flight", "Updates being processed right now",
+    lambda: update_scheduler.in_flight if update_scheduler else 0
+)
+metrics_registry.callback(
+    "bot_updates_pending", "Updates waiting in the ingress queue",
+    lambda: update_scheduler.pending if update_scheduler else 0
+)
+metrics_registry.callback(
+    "bot_updates_rejected_total", "Updates rejected because the ingress queue was full",
+    lambda: update_scheduler.rejected if update_scheduler else 0, type_name="counter"
+)
+metrics_registry.callback(
+    "bot_updates_duplicate_total", "Redelivered updates dropped by update_id",
+    lambda: update_deduplicator.duplicates, type_name="counter"
+)
+metrics_registry.callback(
+    "bot_updates_dropped_total", "Updates dropped or failed by reason",
+    lambda: {(reason,): count for reason, count in webhook_stats.items()},
+    labelnames=("reason",), type_name="counter"
+)
+metrics_registry.callback(
+    "bot_sessions_live", "Quiz sessions tracked in memory",
+    lambda: session_manager.live if session_manager else 0
+)
+metrics_registry.callback(
+    "bot_sessions_bytes", "Approximate memory used by sessions",
+    lambda: session_manager.approx_bytes if session_manager else 0
+)
+metrics_registry.callback(
+    "bot_sessions_ended_total", "Sessions ended by the session manager by reason",
+    lambda: {("idle",): session_manager.expired, ("limit",): session_manager.evicted} if session_manager else {},
+    labelnames=("reason",), type_name="counter"
+)
+metrics_registry.callback(
+    "bot_outbound_queue_depth", "Outbound messages waiting to be sent",
+    lambda: outbound.pending if outbound else 0
+)
+metrics_registry.callback(
+    "bot_outbound_sent_total", "Outbound messages sent",
+    lambda: outbound.sent if outbound else 0, type_name="counter"
+)
+metrics_registry.callback(
+    "bot_broadcast_messages_total", "Broadcast messages by result",
+    lambda: {
+        ("sent",): broadcasts.sent, ("failed",): broadcasts.failed, ("pruned",): broadcasts.pruned
+    } if broadcasts else {},
+    labelnames=("result",), type_name="counter"
+)
+metrics_registry.callback(
+    "bot_log_records_dropped_total", "Log records not written by reason",
+    lambda: {
+        ("queue_full",): log_pipeline.stats()["dropped"],
+        ("sampled",): log_pipeline.stats()["sampled_out"],
+    },
+    labelnames=("reason",), type_name="counter"
+)
+metrics_registry.callback(
+    "bot_http_connections_opened_total", "Outbound HTTP connections opened",
+    lambda: http_stats.connections_opened, type_name="counter"
+)
+
+def health_payload():
+    payload = {"status": "ok", "bot": BOT_NAME, "lifecycle": lifecycle_state()}
+    if update_scheduler:
+        payload["updates"] = update_scheduler.stats()
+    payload["webhook"] = dict(webhook_stats, **update_deduplicator.stats())
+    if outbound:
+        payload["outbound"] = outbound.stats()
+    if state_persistence:
+        payload["state"] = state_persistence.stats()
+    if session_manager:
+        payload["sessions"] = session_manager.stats()
+    payload["quizzes"] = quiz_registry.stats()
+    if broadcasts:
+        payload["broadcasts"] = broadcasts.stats()
+    payload["http"] = http_stats.snapshot()
+    payload["logging"] = log_pipeline.stats()
+    payload["startup"] = startup_stats
+    webhook_info, age = bot_metadata.peek("webhook_info")
+    if webhook_info is not None:
+        payload["telegram_webhook"] = {
+            "url": webhook_info.url,
+            "pending_update_count": webhook_info.pending_update_count,
+            "last_error_message": webhook_info.last_error_message,
+            "last_error_date": webhook_info.last_error_date.isoformat() if webhook_info.last_error_date else None,
+            "age_s": round(age, 1),
+        }
+    payload["metadata_cache"] = bot_metadata.stats()
+    # Устаревшие данные обновляются в фоне, не чаще раза в WEBHOOK_INFO_TTL
+    if accepting_updates and bot_metadata.is_stale("webhook_info"):
+        bot_loop.call_soon_threadsafe(
+            bot_metadata.refresh, "webhook_info", telegram_application.bot.get_webhook_info
+        )
+    return payload
+
+def lifecycle_state():
+    if draining:
+        return "draining"
+    return "running" if accepting_updates else "starting"
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "ok", "bot": BOT_NAME}), 200
+def readiness_check():
+    """Готов ли процесс принимать вебхуки: не во время запуска и не во время остановки."""
+    return accepting_updates, {"status": lifecycle_state()}
 
-@app.route('/')
-def home():
-    return jsonify({"message": "QA Polls Bot is running"}), 200
+def liveness_check():
+    """Процесс жив, пока отвечает; остановка - тоже нормальное состояние."""
+    return True, {"status": lifecycle_state()}
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    logger.info(f"Received webhook request: {request.method} {request.url}")
+def analytics_payload():
+    """Отчет по опросам. В многопроцессном режиме снимки воркеров уже загружены таймером."""
+    return quiz_analytics.report()
+
+def home_payload():
+    return {"message": "QA Polls Bot is running"}
+
+def create_flask_app():
+    """Flask-приложение для SERVER_MODE=flask. Flask импортируется только в этом режиме."""
+    from flask import Flask, Response, g, jsonify, request
+        
+    app = Flask(__name__)
     
-    # Проверка секретного токена
-    secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
-    if secret_token != SECRET_TOKEN:
-        logger.warning(f"Invalid secret token received: {secret_token} (expected: {SECRET_TOKEN})")
-        return jsonify({"status": "forbidden"}), 403
+    @app.route('/health')
+    def health():
+        return jsonify(health_payload()), 200
     
-    try:
-        json_data = request.get_json()
-        logger.debug(f"Webhook JSON data: {json_data}")
+    @app.route('/health/ready')
+    def health_ready():
+        ready, payload = readiness_check()
+        return jsonify(payload), 200 if ready else 503
+    
+    @app.route('/health/live')
+    def health_live():
+        alive, payload = liveness_check()
+        return jsonify(payload), 200 if alive else 503
+    
+    @app.route('/')
+    def home():
+        return jsonify(home_payload()), 200
+    
+    @app.route('/metrics')
+    def metrics():
+        return Response(metrics_registry.render(), mimetype=METRICS_CONTENT_TYPE)
+    
+    @app.route('/analytics')
+    def analytics():
+        if not ANALYTICS_TOKEN or request.headers.get('X-Analytics-Token') != ANALYTICS_TOKEN:
+            return jsonify({"status": "forbidden"}), 403
+        return jsonify(analytics_payload()), 200
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        if request.path == '/webhook':
+            record_webhook_request(response.status_code, time.perf_counter() - g.request_started)
+        return response
+    
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        logger.info("Received webhook request: %s %s", request.method, request.url, extra=HOT)
         
+        # Проверка секретного токена
+        secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
+        if secret_token != SECRET_TOKEN:
+            logger.warning(f"Invalid secret token received: {secret_token} (expected: {SECRET_TOKEN})")
+            return jsonify({"status": "forbidden"}), 403
+        
+        json_data = request.get_json(silent=True)
         if not json_data:
             logger.warning("Empty JSON data received")
             return jsonify({"status": "bad request"}), 400
-            
-        update = Update.de_json(json_data, telegram_application.bot)
         
-        # Асинхронная обработка обновления
-        asyncio.run_coroutine_threadsafe(
-            process_update(update),
-            telegram_application.update_queue._loop
-        )
+        # Сервер поднимается раньше бота, а останавливается позже;
+        # в это время просим Telegram повторить доставку
+        if not accepting_updates:
+            return jsonify({"status": lifecycle_state()}), 503
+        
+        # Обновление только ставится в очередь, обработка идет уже после ответа
+        accepted = asyncio.run_coroutine_threadsafe(submit_update(json_data), bot_loop).result()
+        if not accepted and not accepting_updates:
+            return jsonify({"status": lifecycle_state()}), 503
+        if not accepted:
+            logger.warning("Update queue is full, asking Telegram to retry later")
+            return jsonify({"status": "overloaded"}), 503
         
         return jsonify({"status": "ok"}), 200
-    except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 500
+    
+    return app
+
+def update_chat_key(json_data):
+    """Ключ, по которому обновления упорядочиваются в планировщике.
+
+    Берется прямо из JSON, чтобы не декодировать обновление до ответа Telegram.
+    """
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                  'callback_query', 'my_chat_member', 'chat_member', 'chat_join_request'):
+        payload = json_data.get(field)
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+        sender = payload.get('from')
+        if sender and 'id' in sender:
+            return sender['id']
+    # Обновления без чата и пользователя ни с чем не упорядочиваем
+    return ('update', json_data.get('update_id'))
+
+async def submit_update(json_data):
+    """Принимает JSON обновления: отсеивает повторы и ставит его в очередь.
 
-async def process_update(update):
+    Возвращает False, если очередь переполнена или бот уже останавливается -
+    тогда Telegram должен повторить доставку. Повторы и некорректные данные
+    подтверждаются, чтобы Telegram не присылал их снова, и учитываются в счетчиках.
+    """
+    # Проверка в потоке Flask могла пройти до начала остановки; здесь, в цикле
+    # бота, флаг меняется атомарно относительно drain
+    if not accepting_updates:
+        return False
+    update_id = json_data.get('update_id') if isinstance(json_data, dict) else None
+    if not isinstance(update_id, int):
+        webhook_stats['dropped'] += 1
+        logger.warning("Dropping update without update_id")
+        return True
+    if update_deduplicator.is_duplicate(update_id):
+        logger.info("Duplicate update %s dropped", update_id, extra=HOT)
+        return True
+    # Запоминаем до постановки в очередь: submit может ждать места, и повтор,
+    # пришедший за это время, не должен пройти проверку
+    update_deduplicator.add(update_id)
+    received_at = time.perf_counter()
+    if not await update_scheduler.submit(update_chat_key(json_data), (json_data, received_at)):
+        # Не приняли - Telegram повторит доставку, и ее нужно будет обработать
+        update_deduplicator.discard(update_id)
+        return False
+    return True
+
+async def process_update(item):
+    json_data, received_at = item
+    chat_key = update_chat_key(json_data)
+    log_context = bind_update(json_data.get('update_id'), chat_key if isinstance(chat_key, int) else None)
     try:
-        logger.info(f"Processing update: {update.update_id}")
+        update = Update.de_json(json_data, telegram_application.bot)
+        logger.info("Processing update: %s", update.update_id, extra=HOT)
         await telegram_application.process_update(update)
+        user = update.effective_user
+        if user is not None and telegram_application.user_data.get(user.id) == {}:
+            # Пустой user_data остается после любого обновления; без опроса его незачем держать
+            telegram_application.drop_user_data(user.id)
     except Exception as e:
+        webhook_stats['failed'] += 1
         logger.error(f"Error processing update: {e}", exc_info=True)
+    finally:
+        finished = time.perf_counter()
+        update_seconds.observe(finished - received_at)
+        if startup_stats["first_reply_s"] is None:
+            startup_stats["first_reply_s"] = round(finished - BOOT_STARTED, 3)
+            logger.info(
+                f"Time to first reply: {startup_stats['first_reply_s']:.2f}s after start "
+                f"(update waited {finished - received_at:.2f}s)"
+            )
+        unbind_update(log_context)
 
 # Состояния разговора
 QUESTIONS = 1
 
-questions = [
-    "*1.* *Замечаю опечатки в текстах*",
-    "*2.* *Люблю решать головоломки и логические задачи*",
-    "*3.* *Могу многократно проверять одно и то же*",
-    "*4.* *Изучая новое приложение, стараюсь разобраться во всех его функциях*",
-    "*5.* *Насколько вам интересны новые технологии и IT-сфера?*"
-]
-
-reply_keyboard = [["1 😞", "2 😐", "3 😊", "4 😃", "5 🤩"]]
-markup = ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
-
 main_menu_keyboard = [
     [KeyboardButton("Начать тест 🚀"), KeyboardButton("О курсе ℹ️")],
     [KeyboardButton("Проверить бота ✅")]
 ]
 main_menu_markup = ReplyKeyboardMarkup(main_menu_keyboard, resize_keyboard=True)
 
-def keep_alive():
-    time.sleep(15)
+START_BUTTON = "Начать тест 🚀"
+# Кнопки, которые начинают опрос: START_BUTTON и start_button из определений опросов
+start_buttons_filter = ExactTextFilter([START_BUTTON])
+
+def update_start_buttons(registry):
+    start_buttons_filter.texts = frozenset([START_BUTTON, *registry.start_buttons()])
+
+# Опросы из QUIZ_DIR; тексты и клавиатуры собираются при загрузке и при изменении файлов
+quiz_registry = QuizRegistry(
+    QUIZ_DIR,
+    values={"bot_name": BOT_NAME, "tg_link": TG_LINK, "vk_link": VK_LINK},
+    required=(DEFAULT_QUIZ,),
+    on_reload=update_start_buttons
+)
+quiz_registry.load()
+
+def session_quiz(user_data):
+    """Опрос, который проходит пользователь, в той версии, с которой он начал.
+
+    None, если опроса в ``user_data`` нет - например, сессию уже завершил
+    SessionManager, а разговор еще ждал ответа.
+    """
+    if not has_quiz_state(user_data):
+        return None
+    return quiz_registry.resolve(user_data.get(QUIZ_REF_KEY), DEFAULT_QUIZ)
+
+def quiz_for_start(update, context):
+    """Опрос по /start <id> (deep link), по кнопке опроса или опрос по умолчанию."""
+    quiz_id = context.args[0] if context.args else quiz_registry.start_buttons().get(update.message.text)
+    return quiz_registry.get(quiz_id) or quiz_registry.get(DEFAULT_QUIZ)
+
+async def keep_alive():
+    """Периодически пингует /health, чтобы сервис не засыпал. Работает на event loop бота."""
+    await asyncio.sleep(15)
     logger.info("Starting keep-alive service")
     
-    while True:
-        try:
-            if WEBHOOK_URL:
-                health_url = f"{WEBHOOK_URL}/health"
-                response = requests.get(health_url, timeout=10)
-                logger.info(f"Keep-alive: Service status {response.status_code}")
-            else:
-                logger.info("Keep-alive: WEBHOOK_URL not set")
-        except Exception as e:
-            logger.error(f"Keep-alive error: {str(e)}")
-        time.sleep(300)
+    async with build_async_client(
+        http_stats,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        timeout=HTTP_READ_TIMEOUT,
+        http_version=HTTP_VERSION
+    ) as client:
+        while True:
+            try:
+                if WEBHOOK_URL:
+                    health_url = f"{WEBHOOK_URL}/health"
+                    with http_stats.track("keep-alive"):
+                        response = await client.get(health_url)
+                    logger.info(f"Keep-alive: Service status {response.status_code}")
+                else:
+                    logger.info("Keep-alive: WEBHOOK_URL not set")
+            except Exception as e:
+                logger.error(f"Keep-alive error: {str(e)}")
+            await asyncio.sleep(KEEP_ALIVE_INTERVAL)
 
-async def setup_webhook(app: Application):
+WEBHOOK_ALLOWED_UPDATES = ["message", "callback_query"]
+BOT_COMMANDS = [
+    ("start", "Начать тест"),
+    ("about", "О курсе"),
+    ("health", "Проверить работу бота"),
+    ("menu", "Показать меню"),
+    ("status", "Статус бота")
+]
+
+async def setup_webhook(app: Application, cache, webhook_info=None):
+    """Регистрирует вебхук, если Telegram знает не тот, что нужен.
+
+    Секрет в getWebhookInfo не виден, поэтому совпадение проверяется и по
+    кэшу последней регистрации. Накопившиеся за время простоя обновления не
+    сбрасываются - Telegram доставит их, как только вебхук заработает.
+    """
     webhook_url = f"{WEBHOOK_URL}/webhook"
-    logger.info(f"Setting webhook to: {webhook_url}")
+    wanted = {
+        "url": webhook_url,
+        "secret": fingerprint(SECRET_TOKEN),
+        "allowed_updates": WEBHOOK_ALLOWED_UPDATES
+    }
+    if (webhook_info is not None
+            and webhook_info.url == webhook_url
+            and sorted(webhook_info.allowed_updates or ()) == sorted(WEBHOOK_ALLOWED_UPDATES)
+            and cache.get("webhook") == wanted):
+        logger.info(f"Webhook already set to {webhook_url}, pending updates: {webhook_info.pending_update_count}")
+        return True
     
-    try:
-        await app.bot.delete_webhook()
-        logger.info("Old webhook removed")
-    except Exception as e:
-        logger.warning(f"Error deleting old webhook: {str(e)}")
-
+    logger.info(f"Setting webhook to: {webhook_url}")
     try:
         await app.bot.set_webhook(
             url=webhook_url,
             secret_token=SECRET_TOKEN,
-            drop_pending_updates=True,
-            allowed_updates=["message", "callback_query"]
+            drop_pending_updates=False,
+            allowed_updates=WEBHOOK_ALLOWED_UPDATES
         )
+        cache.set("webhook", wanted)
+        bot_metadata.invalidate("webhook_info")
         logger.info("Webhook set successfully")
         return True
     except Exception as e:
         logger.error(f"Error setting webhook: {str(e)}", exc_info=True)
         return False
 
-async def post_init(app: Application) -> None:
-    logger.info("Running post-initialization")
-    
-    # Установка вебхука
-    webhook_success = await setup_webhook(app)
-    if not webhook_success:
-        logger.critical("Webhook setup failed, bot may not receive updates")
-    
-    # Установка команд меню
+async def setup_commands(app: Application, commands=None):
+    """Устанавливает команды меню, если текущие отличаются от BOT_COMMANDS."""
+    if commands is not None and [(c.command, c.description) for c in commands] == BOT_COMMANDS:
+        logger.info("Bot commands are up to date")
+        return
     try:
-        await app.bot.set_my_commands([
-            ("start", "Начать тест"),
-            ("about", "О курсе"),
-            ("health", "Проверить работу бота"),
-            ("menu", "Показать меню"),
-            ("status", "Статус бота")
-        ])
+        await app.bot.set_my_commands(BOT_COMMANDS)
         logger.info("Bot commands set successfully")
     except Exception as e:
         logger.error(f"Error setting bot commands: {str(e)}", exc_info=True)
 
-def create_telegram_app() -> Application:
-    global telegram_application
-    builder = Application.builder().token(TOKEN)
-    builder.post_init(post_init)
+async def post_init(app: Application, cache, webhook_info=None, commands=None) -> None:
+    """Регистрация вебхука и команд. Вызывается из run_bot после запуска HTTP-сервера."""
+    logger.info("Running post-initialization")
+    
+    steps = [setup_commands(app, commands)]
+    if WEBHOOK_URL:
+        steps.append(setup_webhook(app, cache, webhook_info))
+    results = await asyncio.gather(*steps)
+    if WEBHOOK_URL and not results[-1]:
+        logger.critical("Webhook setup failed, bot may not receive updates")
+    cache.save()
+
+def create_state_persistence():
+    if STATE_BACKEND == 'none':
+        return None
+    return WriteBehindPersistence(
+        create_backend(STATE_BACKEND, STATE_DB_PATH),
+        flush_interval=STATE_FLUSH_INTERVAL,
+        batch_size=STATE_BATCH_SIZE
+    )
+
+def create_telegram_app(with_persistence=True) -> Application:
+    global telegram_application, state_persistence, quiz_conversation
+    builder = Application.builder().token(TOKEN).base_url(TELEGRAM_API_BASE_URL)
+    builder.request(InstrumentedHTTPXRequest(
+        http_stats,
+        pool_size=HTTP_POOL_SIZE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=HTTP_VERSION
+    ))
+    state_persistence = create_state_persistence() if with_persistence else None
+    if state_persistence:
+        builder.persistence(state_persistence)
     telegram_application = builder.build()
     
     # Обработчики команд
+    if QUIZ_MODE == 'inline':
+        # Ответы приходят только кнопками, свободный текст в опросе не обрабатывается
+        quiz_state_handlers = [CallbackQueryHandler(handle_inline_answer, pattern=INLINE_ANSWER_PATTERN)]
+        # Разговор ведется по чату и пользователю, отслеживать каждое сообщение не нужно
+        warnings.filterwarnings("ignore", message="If 'per_message=False'", category=PTBUserWarning)
+    else:
+        quiz_state_handlers = [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_answer)]
+    
+    # /start посреди опроса начинает его заново - в том числе если сессию уже
+    # завершил SessionManager, а разговор еще ждет ответа
+    quiz_state_handlers.insert(0, CommandHandler("start", start))
+    
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
-            MessageHandler(filters.Regex("^Начать тест 🚀$"), start)
+            MessageHandler(start_buttons_filter, start)
         ],
         states={
-            QUESTIONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_answer)]
+            QUESTIONS: quiz_state_handlers
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="quiz",
+        persistent=state_persistence is not None
     )
     
+    # Кнопки главного меню: подпись -> обработчик, одна проверка по хеш-таблице.
+    # "Начать тест" обрабатывается точкой входа разговора выше.
+    menu_routes.clear()
+    menu_routes.update(build_text_routes(main_menu_keyboard, {
+        "О курсе ℹ️": about_course,
+        "Проверить бота ✅": telegram_health,
+    }, handled_elsewhere=(START_BUTTON,)))
+    
     telegram_application.add_handler(conv_handler)
+    quiz_conversation = conv_handler
+    if QUIZ_MODE == 'inline':
+        # Сюда попадают только нажатия, которые не обработал разговор
+        telegram_application.add_handler(
+            CallbackQueryHandler(answer_stale_callback, pattern=INLINE_ANSWER_PATTERN)
+        )
     telegram_application.add_handler(CommandHandler("health", telegram_health))
     telegram_application.add_handler(CommandHandler("about", about_course))
     telegram_application.add_handler(CommandHandler("status", bot_status))
-    telegram_application.add_handler(MessageHandler(filters.Regex("^О курсе ℹ️$"), about_course))
-    telegram_application.add_handler(MessageHandler(filters.Regex("^Проверить бота ✅$"), telegram_health))
+    telegram_application.add_handler(MessageHandler(ExactTextFilter(menu_routes), dispatch_menu_button))
     telegram_application.add_handler(CommandHandler("menu", show_menu))
+    if ADMIN_IDS:
+        admins = filters.User(user_id=ADMIN_IDS)
+        telegram_application.add_handler(CommandHandler("stats", admin_stats, filters=admins))
+        telegram_application.add_handler(CommandHandler("broadcast", admin_broadcast, filters=admins))
+        telegram_application.add_handler(CommandHandler("broadcasts", admin_broadcasts, filters=admins))
+        telegram_application.add_handler(
+            CommandHandler("broadcast_cancel", admin_broadcast_cancel, filters=admins)
+        )
     telegram_application.add_error_handler(error_handler)
     
     return telegram_application
 
+@timed_handler
 async def bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        me = await context.bot.get_me()
-        webhook_info = await context.bot.get_webhook_info()
+        me, webhook_info = await asyncio.gather(
+            bot_metadata.get("me", context.bot.get_me),
+            bot_metadata.get("webhook_info", context.bot.get_webhook_info)
+        )
         
         status_text = (
             f"🤖 *Статус бота:*\n"
@@ -209,25 +738,30 @@ async def bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🔐 *Секретный токен:* `{SECRET_TOKEN[:3]}...{SECRET_TOKEN[-3:]}`"
         )
         
-        await update.message.reply_text(
+        await reply(
+            update,
             status_text,
             parse_mode="Markdown",
             reply_markup=main_menu_markup
         )
     except Exception as e:
         logger.error(f"Error in bot_status: {str(e)}", exc_info=True)
-        await update.message.reply_text(
+        await reply(
+            update,
             "⚠️ Ошибка при получении статуса бота",
             reply_markup=main_menu_markup
         )
 
+@timed_handler
 async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(
+    await reply(
+        update,
         "🏠 *Главное меню* 🏠\n\nВыберите действие:",
         reply_markup=main_menu_markup,
         parse_mode="Markdown"
     )
 
+@timed_handler
 async def about_course(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     about_text = """
 🌟 *О курсе* 🌟
@@ -261,143 +795,227 @@ async def about_course(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 За подробностями пишите мне в Telegram: [@Dmitrii_Fursa8](https://t.me/Dmitrii_Fursa8)
 """
     
-    await update.message.reply_text(
+    await reply(
+        update,
         about_text,
         parse_mode="Markdown",
         disable_web_page_preview=True,
         reply_markup=main_menu_markup
     )
 
+@timed_handler
 async def telegram_health(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(
+    await reply(
+        update,
         f"✅ {BOT_NAME} работает нормально!",
         reply_markup=main_menu_markup
     )
 
+# Заполняется в create_telegram_app по определению main_menu_keyboard
+menu_routes = {}
+
+async def dispatch_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await menu_routes[update.message.text](update, context)
+
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         user = update.message.from_user
-        logger.info(f"Command /start received from user {user.id}")
+        logger.info("Command /start received from user %s", user.id, extra=HOT)
         
+        quiz = quiz_for_start(update, context)
         context.user_data.clear()
-        context.user_data['answers'] = []
-        context.user_data['current_question_index'] = 0
+        store_quiz_state(context.user_data, 0)
+        context.user_data[QUIZ_REF_KEY] = quiz.ref
+        quiz_analytics.started(quiz)
+        track_session(update)
         
-        welcome_text = (
-            f"Привет, {user.first_name}! Я {BOT_NAME}, помогу оценить твои качества для работы в тестировании.\n\n"
-            "Ответь на 5 тезисов по шкале от 1 до 5, где:\n"
-            "1 😞 - совсем не обо мне\n"
-            "5 🤩 - это точно про меня\n"
-        )
+        welcome_text = quiz.greeting(user.first_name)
         
-        await update.message.reply_text(
-            welcome_text,
-            parse_mode="Markdown",
-            reply_markup=ReplyKeyboardRemove()
-        )
+        if QUIZ_MODE == 'inline':
+            # Приветствие и первый вопрос - одно сообщение, дальше оно только редактируется
+            await reply(
+                update,
+                f"{welcome_text}\n{quiz.questions[0]}",
+                reply_markup=quiz.inline_markups[0],
+                parse_mode="Markdown"
+            )
+            return QUESTIONS
         
-        await update.message.reply_text(
-            questions[0],
-            reply_markup=markup,
-            parse_mode="Markdown"
-        )
+        # Приветствие и первый вопрос уходят подряд и могут быть склеены в одно сообщение
+        await reply_many(update, [
+            dict(text=welcome_text, parse_mode="Markdown", reply_markup=ReplyKeyboardRemove()),
+            dict(text=quiz.questions[0], reply_markup=quiz.reply_markup, parse_mode="Markdown")
+        ])
         
         return QUESTIONS
     except Exception as e:
         logger.error(f"Error in start command: {str(e)}", exc_info=True)
-        await update.message.reply_text(
+        await reply(
+            update,
             "⚠️ Произошла ошибка при запуске. Попробуйте снова.",
             reply_markup=main_menu_markup
         )
         return ConversationHandler.END
 
+@timed_handler
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         user = update.message.from_user
         answer_text = update.message.text
-        logger.info(f"User {user.id} answer: {answer_text}")
+        logger.info("User %s answer: %s", user.id, answer_text, extra=HOT)
         
-        answer = answer_text.split()[0]
+        quiz = session_quiz(context.user_data)
+        state = quiz_state(context.user_data)
+        current_question_index = question_index(state)
+        if quiz is None or current_question_index >= len(quiz.questions):
+            return await quiz_unavailable(update, context)
+        track_session(update)
         
-        answers = context.user_data.get('answers', [])
-        current_question_index = context.user_data.get('current_question_index', 0)
-        
-        if not answer.isdigit() or int(answer) < 1 or int(answer) > 5:
-            await update.message.reply_text(
-                "Пожалуйста, выберите цифру от 1 до 5",
-                reply_markup=markup
-            )
-            await update.message.reply_text(
-                questions[current_question_index],
-                reply_markup=markup,
-                parse_mode="Markdown"
-            )
+        score = quiz.parse_answer(answer_text)
+        if score is None:
+            quiz_analytics.invalid(quiz, current_question_index)
+            await reply_many(update, [
+                dict(text=quiz.invalid_answer, reply_markup=quiz.reply_markup),
+                dict(
+                    text=quiz.questions[current_question_index],
+                    reply_markup=quiz.reply_markup,
+                    parse_mode="Markdown"
+                )
+            ])
             return QUESTIONS
         
-        answers.append(int(answer))
-        context.user_data['answers'] = answers
-        
-        next_question_index = current_question_index + 1
-        context.user_data['current_question_index'] = next_question_index
+        state = add_answer(state, score)
+        store_quiz_state(context.user_data, state)
+        quiz_analytics.answered(quiz, current_question_index, score)
         
-        if next_question_index < len(questions):
-            await update.message.reply_text(
-                questions[next_question_index],
-                reply_markup=markup,
+        next_question_index = question_index(state)
+        if next_question_index < len(quiz.questions):
+            await reply(
+                update,
+                quiz.questions[next_question_index],
+                reply_markup=quiz.reply_markup,
                 parse_mode="Markdown"
             )
             return QUESTIONS
         
-        total = sum(answers)
-        result = "🔍 *Ваши результаты* 🔍\n\n"
+        # Опрос пройден - состояние больше не нужно держать в памяти
+        clear_quiz_state(context.user_data)
+        finish_session(update)
+        total = total_score(state)
+        quiz_analytics.completed(quiz, total)
+        if broadcasts:
+            broadcasts.add_recipient(update.effective_chat.id, quiz.id)
         
-        if total >= 20:
-            result += (
-                "🚀 *Отличные задатки для тестировщика!*\n\n"
-                "Твой результат показывает высокую склонность к тестированию. "
-                "Чтобы превратить это в профессию:\n\n"
-                f"👉 Напиши мне в Telegram: [@Dmitrii_Fursa8]({TG_LINK})\n"
-                f"👉 Подписывайся на меня в ВКонтакте: [Dmitrii Fursa]({VK_LINK})"
-            )
-        elif total >= 15:
-            result += (
-                "🌟 *Хороший потенциал!*\n\n"
-                "У тебя есть базовые качества тестировщика. "
-                "Чтобы развить их до профессионального уровня:\n\n"
-                f"👉 Напиши мне в Telegram: [@Dmitrii_Fursa8]({TG_LINK})\n"
-                f"👉 Подписывайся на меня в ВКонтакте: [Dmitrii Fursa]({VK_LINK})"
-            )
-        else:
-            result += (
-                "💡 *Тестирование может быть не твоим основным призванием, но это не значит, что IT не для тебя!*\n\n"
-                "Если ты хочешь:\n"
-                "• Стать тестировщиком и войти в IT\n"
-                "• Получить востребованную профессию\n"
-                "• Освоить навыки, которые откроют двери в мир технологий\n\n"
-                f"👉 Пиши мне в Telegram: [@Dmitrii_Fursa8]({TG_LINK})\n"
-                f"👉 Подписывайся на меня в ВКонтакте: [Dmitrii Fursa]({VK_LINK})"
-            )
-        
-        await update.message.reply_text(
-            result,
+        await reply(
+            update,
+            quiz.result_text(total),
             parse_mode="Markdown",
             disable_web_page_preview=True,
             reply_markup=main_menu_markup
         )
         
-        logger.info(f"Test completed for user {user.id}. Score: {total}")
+        logger.info("Test completed for user %s. Score: %s", user.id, total, extra=HOT)
         return ConversationHandler.END
     except Exception as e:
         logger.error(f"Error handling answer: {str(e)}", exc_info=True)
-        await update.message.reply_text(
+        await reply(
+            update,
             "⚠️ Произошла ошибка. Попробуйте начать заново командой /start",
             reply_markup=main_menu_markup
         )
         return ConversationHandler.END
 
+@timed_handler
+async def handle_inline_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    try:
+        logger.info("User %s inline answer: %s", query.from_user.id, query.data, extra=HOT)
+        
+        question_part, answer = query.data.split(":")
+        pressed_index = int(question_part[1:])
+        quiz = session_quiz(context.user_data)
+        state = quiz_state(context.user_data)
+        if quiz is None or question_index(state) >= len(quiz.questions):
+            await query.answer()
+            return await quiz_unavailable(update, context)
+        track_session(update)
+        
+        score = int(answer)
+        if pressed_index != question_index(state) or not quiz.is_valid_score(score):
+            # Нажатие на кнопку уже отвеченного вопроса или поддельные данные кнопки
+            await query.answer()
+            return QUESTIONS
+        
+        state = add_answer(state, score)
+        store_quiz_state(context.user_data, state)
+        quiz_analytics.answered(quiz, pressed_index, score)
+        
+        next_question_index = question_index(state)
+        if next_question_index < len(quiz.questions):
+            await asyncio.gather(
+                query.answer(),
+                edit_query_message(
+                    query,
+                    quiz.questions[next_question_index],
+                    reply_markup=quiz.inline_markups[next_question_index],
+                    parse_mode="Markdown"
+                )
+            )
+            return QUESTIONS
+        
+        clear_quiz_state(context.user_data)
+        finish_session(update)
+        total = total_score(state)
+        quiz_analytics.completed(quiz, total)
+        if broadcasts:
+            broadcasts.add_recipient(update.effective_chat.id, quiz.id)
+        await asyncio.gather(
+            query.answer(),
+            edit_query_message(
+                query,
+                quiz.result_text(total),
+                parse_mode="Markdown",
+                disable_web_page_preview=True
+            )
+        )
+        
+        logger.info("Test completed for user %s. Score: %s", query.from_user.id, total, extra=HOT)
+        return ConversationHandler.END
+    except Exception as e:
+        logger.error(f"Error handling inline answer: {str(e)}", exc_info=True)
+        await reply(
+            update,
+            "⚠️ Произошла ошибка. Попробуйте начать заново командой /start",
+            reply_markup=main_menu_markup
+        )
+        return ConversationHandler.END
+
+async def answer_stale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка опроса нажата, когда разговор уже закончен: убираем часики на кнопке."""
+    await update.callback_query.answer("Этот опрос уже завершен. Начните заново командой /start")
+
+async def quiz_unavailable(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Опрос удален, изменился или его сессия завершена - продолжить нельзя."""
+    clear_quiz_state(context.user_data)
+    finish_session(update)
+    await reply(
+        update,
+        "Этот опрос завершен или изменился. Начните его заново командой /start",
+        reply_markup=main_menu_markup
+    )
+    return ConversationHandler.END
+
+@timed_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        await update.message.reply_text(
+        quiz = session_quiz(context.user_data)
+        if quiz is not None:
+            quiz_analytics.cancelled(quiz, question_index(quiz_state(context.user_data)))
+        clear_quiz_state(context.user_data)
+        finish_session(update)
+        await reply(
+            update,
             "Тест отменен",
             reply_markup=main_menu_markup
         )
@@ -406,54 +1024,423 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         logger.error(f"Error in cancel command: {str(e)}", exc_info=True)
         return ConversationHandler.END
 
+def format_analytics_report(report):
+    """Текст отчета для /stats: воронка, баллы и некорректные ответы по каждому опросу."""
+    if not report:
+        return "Статистики пока нет"
+    blocks = []
+    for quiz_id, quiz in report.items():
+        mean = quiz["mean_score"] if quiz["mean_score"] is not None else "-"
+        lines = [
+            f"{quiz['title']} ({quiz_id})",
+            f"Начали: {quiz['started']}, закончили: {quiz['completed']} "
+            f"({quiz['completion_rate']:.0%}), средний балл: {mean}",
+        ]
+        for question in quiz["questions"]:
+            lines.append(
+                f"{question['question']}. показан {question['reached']}, ответов {question['answered']}, "
+                f"отмен {question['cancelled']}, без ответа {question['dropped']}, "
+                f"некорректных {question['invalid_rate']:.0%}"
+            )
+        if quiz["score_distribution"]:
+            lines.append("Баллы: " + ", ".join(
+                f"{total}: {count}" for total, count in quiz["score_distribution"].items()
+            ))
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+@timed_handler
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await reply(update, format_analytics_report(analytics_payload()), priority=PRIORITY_NOTIFICATION)
+    except Exception as e:
+        logger.error(f"Error in stats command: {str(e)}", exc_info=True)
+
+@timed_handler
+async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        # Текст - все после команды, с переносами строк
+        parts = update.message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            await reply(update, "Использование: /broadcast <текст рассылки>", priority=PRIORITY_NOTIFICATION)
+            return
+        job_id = await broadcasts.create(parts[1])
+        logger.info(f"Broadcast {job_id} created by user {update.effective_user.id}")
+        await reply(
+            update,
+            f"Рассылка {job_id} запущена. Прогресс: /broadcasts, отмена: /broadcast_cancel {job_id}",
+            priority=PRIORITY_NOTIFICATION
+        )
+    except Exception as e:
+        logger.error(f"Error in broadcast command: {str(e)}", exc_info=True)
+
+@timed_handler
+async def admin_broadcasts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        jobs, recipients = await broadcasts.recent()
+        lines = [f"Получателей: {recipients}"]
+        for job in jobs:
+            preview = job["text"].splitlines()[0][:40]
+            lines.append(
+                f"{job['id']}. {job['status']}: отправлено {job['sent']} из {job['total']}, "
+                f"ошибок {job['failed']}, удалено {job['pruned']} - {preview}"
+            )
+        await reply(update, "\n".join(lines), priority=PRIORITY_NOTIFICATION)
+    except Exception as e:
+        logger.error(f"Error in broadcasts command: {str(e)}", exc_info=True)
+
+@timed_handler
+async def admin_broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if len(context.args) != 1 or not context.args[0].isdecimal():
+            await reply(update, "Использование: /broadcast_cancel <номер рассылки>", priority=PRIORITY_NOTIFICATION)
+            return
+        job_id = int(context.args[0])
+        cancelled = await broadcasts.cancel(job_id)
+        await reply(
+            update,
+            f"Рассылка {job_id} отменена" if cancelled else f"Рассылка {job_id} не выполняется",
+            priority=PRIORITY_NOTIFICATION
+        )
+    except Exception as e:
+        logger.error(f"Error in broadcast_cancel command: {str(e)}", exc_info=True)
+
+@timed_handler
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling Telegram update:", exc_info=context.error)
     
-    if update and update.effective_message:
+    # Сетевые ошибки и флуд-лимиты не повод слать пользователю еще одно сообщение
+    if isinstance(context.error, (RetryAfter, NetworkError)):
+        return
+    
+    if isinstance(update, Update) and update.effective_message:
         try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="😢 Произошла непредвиденная ошибка. Пожалуйста, попробуйте снова.",
+            await reply(
+                update,
+                "😢 Произошла непредвиденная ошибка. Пожалуйста, попробуйте снова.",
+                priority=PRIORITY_NOTIFICATION,
                 reply_markup=main_menu_markup
             )
         except Exception as e:
             logger.error(f"Failed to send error notification: {str(e)}")
 
+async def reply(update, text, priority=PRIORITY_QUIZ, **kwargs):
+    """Ответ в чат обновления через планировщик исходящих сообщений."""
+    return await outbound.send(update.effective_chat.id, text, priority, **kwargs)
+
+async def reply_many(update, messages, priority=PRIORITY_QUIZ):
+    """Несколько ответов подряд; соседние сообщения могут быть склеены в одно."""
+    return await outbound.send_many(update.effective_chat.id, messages, priority)
+
+async def edit_query_message(query, text, **kwargs):
+    """Редактирует сообщение с inline-кнопками через планировщик исходящих сообщений."""
+    return await outbound.call(
+        query.message.chat_id,
+        'edit_message_text',
+        PRIORITY_QUIZ,
+        message_id=query.message.message_id,
+        text=text,
+        **kwargs
+    )
+
 def run_flask():
     logger.info(f"Starting Flask server on port {PORT}")
-    app.run(host='0.0.0.0', port=PORT, threaded=True)
+    create_flask_app().run(host='0.0.0.0', port=PORT, threaded=True)
 
-async def run_bot():
-    global telegram_application
+def track_session(update):
+    if session_manager:
+        session_manager.touch(update.effective_chat.id, update.effective_user.id)
+
+def finish_session(update):
+    if session_manager:
+        session_manager.finish(update.effective_chat.id, update.effective_user.id)
+
+async def send_session_evicted(chat_id):
+    try:
+        await outbound.send(
+            chat_id,
+            "Опрос прерван из-за высокой нагрузки. Начните его заново командой /start",
+            PRIORITY_NOTIFICATION,
+            reply_markup=main_menu_markup
+        )
+    except Exception as e:
+        logger.warning(f"Failed to notify chat {chat_id} about interrupted quiz: {e}")
+
+def notify_session_evicted(chat_id, user_id):
+    task = asyncio.create_task(send_session_evicted(chat_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def create_session_manager():
+    manager = SessionManager(
+        idle_ttl=SESSION_IDLE_TTL,
+        max_sessions=SESSION_MAX_COUNT,
+        max_bytes=int(SESSION_MEMORY_MB * 1024 * 1024) or None,
+        sweep_interval=SESSION_SWEEP_INTERVAL,
+        min_idle=SESSION_MIN_IDLE,
+        on_evicted=notify_session_evicted
+    )
+    manager.attach(telegram_application, quiz_conversation)
+    if state_persistence:
+        # Разговоры, начатые до перезапуска, тоже должны истекать
+        manager.restore(state_persistence.restored_conversations(quiz_conversation.name))
+    manager.start()
+    return manager
+
+def start_quiz_reload():
+    if QUIZ_RELOAD_INTERVAL > 0:
+        background_tasks.add(asyncio.create_task(
+            quiz_registry.watch(QUIZ_RELOAD_INTERVAL), name="quiz-reload"
+        ))
+
+def start_analytics(path):
+    quiz_analytics.path = path
+    if WORKERS > 1:
+        quiz_analytics.peers = lambda: [
+            snapshot for snapshot in worker_snapshot_paths(ANALYTICS_PATH) if snapshot != path
+        ]
+    quiz_analytics.load()
+    quiz_analytics.start()
+
+def start_broadcasts(run_jobs=True):
+    engine = BroadcastEngine(
+        BroadcastStore(BROADCAST_DB_PATH),
+        outbound,
+        concurrency=BROADCAST_CONCURRENCY,
+        # Рассылку ведет один воркер, и ей достается не больше его доли общего лимита
+        rate=min(BROADCAST_RATE, OUTBOUND_GLOBAL_RATE / WORKERS),
+        flush_interval=STATE_FLUSH_INTERVAL
+    )
+    engine.start(run_jobs)
+    return engine
+
+def create_outbound():
+    # Лимит Telegram общий на бота: воркеры делят его поровну. Чаты закреплены
+    # за воркерами, поэтому лимит на чат делить не нужно.
+    return OutboundScheduler(
+        telegram_application.bot,
+        global_rate=OUTBOUND_GLOBAL_RATE / WORKERS,
+        chat_rate=OUTBOUND_CHAT_RATE,
+        chat_burst=OUTBOUND_CHAT_BURST,
+        coalesce=OUTBOUND_COALESCE
+    )
+
+async def commit_worker_state():
+    """Сохраняет состояние воркера; после этого обработанные обновления можно подтвердить."""
+    await telegram_application.update_persistence()
+    if state_persistence and not await state_persistence.commit():
+        raise RuntimeError("state store flush failed")
+
+async def run_shard_worker(shard_index, updates, acks):
+    global telegram_application, bot_loop, update_scheduler, outbound, session_manager, broadcasts
+    from workers import AckBatcher, consume_updates
+    bot_loop = asyncio.get_running_loop()
     telegram_application = create_telegram_app()
+    outbound = create_outbound()
+    batcher = AckBatcher(acks, commit_worker_state, WORKER_COMMIT_INTERVAL)
+    
+    async def process_and_ack(item):
+        await process_update(item)
+        batcher.done(item[0]['update_id'])
+    
+    # Ограничение очереди держит фронт, воркер просто ждет места
+    update_scheduler = ChatOrderedScheduler(
+        process_and_ack,
+        concurrency=UPDATE_CONCURRENCY,
+        max_pending=UPDATE_QUEUE_SIZE,
+        overflow_policy='wait',
+        enqueue_timeout=None
+    )
     
-    # Инициализация приложения
     await telegram_application.initialize()
     await telegram_application.start()
-    logger.info("Bot initialized and started")
+    outbound.start()
+    update_scheduler.start()
+    session_manager = create_session_manager()
+    start_quiz_reload()
+    start_analytics(worker_snapshot_path(ANALYTICS_PATH, shard_index))
+    # Задания рассылки выполняет один воркер, получателей записывают все
+    broadcasts = start_broadcasts(run_jobs=shard_index == 0)
+    commit_task = asyncio.create_task(batcher.run(), name="worker-commit")
+    logger.info(f"Worker {shard_index} started")
     
-    # Информация о боте
-    me = await telegram_application.bot.get_me()
-    logger.info(f"Bot info: {me.full_name} (@{me.username})")
+    await consume_updates(
+        updates, lambda item: update_scheduler.submit(update_chat_key(item[0]), item)
+    )
     
-    # Информация о вебхуке
-    try:
-        webhook_info = await telegram_application.bot.get_webhook_info()
+    # Фронт попросил остановиться: дорабатываем принятое и подтверждаем его.
+    # Не успевшего к сроку воркера фронт остановит принудительно.
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    await update_scheduler.drain(SHUTDOWN_TIMEOUT)
+    commit_task.cancel()
+    await batcher.flush()
+    await update_scheduler.stop()
+    await stop_bot_services(deadline)
+    logger.info(f"Worker {shard_index} stopped")
+
+def run_worker(shard_index, updates, acks):
+    """Точка входа процесса-воркера в многопроцессном режиме."""
+    # SIGTERM и Ctrl+C приходят всей группе процессов; остановкой воркеров управляет фронт
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_shard_worker(shard_index, updates, acks))
+
+async def stop_bot_services(deadline):
+    """Останавливает службы процесса, когда обновления уже доработаны.
+
+    Рассылка сохраняет курсор, очередь исходящих отправляется до ``deadline``,
+    затем сохраняются статистика и состояние опросов.
+    """
+    if broadcasts:
+        await broadcasts.stop()
+    if outbound and not await outbound.drain(max(0.0, deadline - time.monotonic())):
+        logger.warning(f"Shutdown deadline reached with {outbound.pending} outbound messages unsent")
+    if session_manager:
+        await session_manager.stop()
+    if outbound:
+        await outbound.stop()
+    await quiz_analytics.stop()
+    # stop/shutdown записывают persistence - прогресс опросов не теряется
+    await telegram_application.stop()
+    await telegram_application.shutdown()
+
+def request_stop(signum):
+    name = signal.Signals(signum).name
+    if stop_requested.is_set():
+        logger.info(f"{name} received again, shutdown is already in progress")
+        return
+    logger.info(f"{name} received, draining before shutdown")
+    stop_requested.set()
+
+async def shutdown(web_server=None):
+    """Остановка по сигналу: новые вебхуки получают 503, принятое дорабатывается за SHUTDOWN_TIMEOUT."""
+    global accepting_updates, draining
+    started = time.monotonic()
+    deadline = started + SHUTDOWN_TIMEOUT
+    draining = True
+    accepting_updates = False
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if WORKERS > 1:
+        # Воркеры дорабатывают свои очереди сами
+        await update_scheduler.stop(timeout=max(0.0, deadline - time.monotonic()))
+    else:
+        if not await update_scheduler.drain(max(0.0, deadline - time.monotonic())):
+            logger.warning(f"Shutdown deadline reached with {update_scheduler.pending} updates unprocessed")
+        await update_scheduler.stop()
+    await stop_bot_services(deadline)
+    if web_server:
+        web_server.stop()
+    logger.info(f"Shutdown complete in {time.monotonic() - started:.2f}s")
+
+async def run_bot():
+    global telegram_application, bot_loop, update_scheduler, outbound, accepting_updates, session_manager, broadcasts
+    global stop_requested
+    bot_loop = asyncio.get_running_loop()
+    # Сигнал во время запуска тоже учитывается: остановка начнется сразу после него
+    stop_requested = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            bot_loop.add_signal_handler(signum, request_stop, signum)
+        except NotImplementedError:  # Windows
+            pass
+    if WORKERS > 1:
+        from workers import ShardRouter
+        # Фронт только принимает вебхуки; состояние опросов ведут воркеры
+        telegram_application = create_telegram_app(with_persistence=False)
+        update_scheduler = ShardRouter(
+            run_worker,
+            WORKERS,
+            max_pending=UPDATE_QUEUE_SIZE,
+            overflow_policy=OVERFLOW_POLICY,
+            enqueue_timeout=ENQUEUE_TIMEOUT
+        )
+    else:
+        telegram_application = create_telegram_app()
+        outbound = create_outbound()
+        update_scheduler = ChatOrderedScheduler(
+            process_update,
+            concurrency=UPDATE_CONCURRENCY,
+            max_pending=UPDATE_QUEUE_SIZE,
+            overflow_policy=OVERFLOW_POLICY,
+            enqueue_timeout=ENQUEUE_TIMEOUT
+        )
+    
+    cache = StartupCache(STARTUP_CACHE_PATH, TOKEN).load()
+    known_bot = cache.get("bot")
+    if known_bot:
+        logger.info(f"Last known bot: @{known_bot.get('username')}")
+    
+    # Инициализация приложения (getMe) и проверка текущей регистрации не
+    # зависят друг от друга - выполняются одновременно
+    initialized, webhook_info, commands = await asyncio.gather(
+        telegram_application.initialize(),
+        telegram_application.bot.get_webhook_info(),
+        telegram_application.bot.get_my_commands(),
+        return_exceptions=True
+    )
+    if isinstance(initialized, Exception):
+        raise initialized
+    if isinstance(webhook_info, Exception):
+        logger.error(f"Error getting webhook info: {str(webhook_info)}")
+        webhook_info = None
+    else:
+        bot_metadata.put("webhook_info", webhook_info)
         logger.info(f"Webhook info: URL={webhook_info.url}, Pending updates={webhook_info.pending_update_count}")
-    except Exception as e:
-        logger.error(f"Error getting webhook info: {str(e)}")
+    if isinstance(commands, Exception):
+        logger.warning(f"Error getting bot commands: {str(commands)}")
+        commands = None
+    
+    await telegram_application.start()
+    if outbound:
+        outbound.start()
+        session_manager = create_session_manager()
+        start_quiz_reload()
+        start_analytics(ANALYTICS_PATH)
+        broadcasts = start_broadcasts()
+    else:
+        # Фронт сам опросы не ведет, но отдает /analytics по снимкам воркеров
+        start_analytics(None)
+    update_scheduler.start()
+    accepting_updates = True
+    me = telegram_application.bot.bot
+    bot_metadata.put("me", me)
+    cache.set("bot", me.to_dict())
+    logger.info(f"Bot info: {me.full_name} (@{me.username})")
+    
+    # Сервер поднимается до регистрации вебхука, чтобы сразу принять накопившиеся обновления
+    web_server = None
+    if SERVER_MODE == 'async':
+        from async_server import start_async_server
+        web_server = await start_async_server(
+            PORT, SECRET_TOKEN, submit_update, health_payload, home_payload,
+            metrics_payload=metrics_registry.render,
+            on_webhook_done=record_webhook_request,
+            analytics_payload=analytics_payload,
+            analytics_token=ANALYTICS_TOKEN,
+            accepting=lambda: accepting_updates,
+            readiness=readiness_check,
+            liveness=liveness_check
+        )
+    
+    await post_init(telegram_application, cache, webhook_info, commands)
+    startup_stats["ready_s"] = round(time.perf_counter() - BOOT_STARTED, 3)
+    logger.info(f"Bot initialized and started in {startup_stats['ready_s']:.2f}s")
     
-    # Бесконечное ожидание
-    await asyncio.Event().wait()
-
-def main():
     if WEBHOOK_URL:
-        keep_alive_thread = threading.Thread(target=keep_alive, daemon=True)
-        keep_alive_thread.start()
+        background_tasks.add(asyncio.create_task(keep_alive(), name="keep-alive"))
         logger.info(f"Starting keep-alive service for {WEBHOOK_URL}")
     
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    await stop_requested.wait()
+    await shutdown(web_server)
+
+def main():
+    if SERVER_MODE == 'async':
+        logger.info(f"Using async webhook server on port {PORT}")
+    else:
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
     
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -472,6 +1459,8 @@ if __name__ == "__main__":
     logger.info(f"TOKEN: {TOKEN[:5]}...{TOKEN[-5:]}")
     logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
     logger.info(f"PORT: {PORT}")
+    logger.info(f"SERVER_MODE: {SERVER_MODE}")
+    logger.info(f"WORKERS: {WORKERS}")
     logger.info(f"SECRET_TOKEN: {SECRET_TOKEN[:3]}...")
     logger.info(f"TG_LINK: {TG_LINK}")
     logger.info(f"VK_LINK: {VK_LINK}")
@@ -0,0 +1,411 @@
+"""Рассылки участникам опросов с учетом лимитов и продолжением после рестарта.
+
+Когда пользователь заканчивает опрос, его чат записывается в таблицу
+получателей (запись копится в памяти и уходит в SQLite пачкой в отдельном
+потоке, обработчик не ждет диска). Рассылка - это задание в той же базе:
+текст, статус и курсор - последний чат, до которого все уже обработано.
+
+``BroadcastEngine`` выполняет задания в фоне на event loop бота:
+
+* сообщения уходят через ``OutboundScheduler`` с самым низким приоритетом,
+  не больше ``concurrency`` одновременно и не быстрее ``rate`` в секунду;
+* пока в очереди исходящих есть ответы опроса, рассылка ждет - живой
+  трафик не задерживается;
+* при ``RetryAfter`` задание целиком ставится на паузу на указанное время;
+* пользователи, заблокировавшие бота или удаленные, убираются из получателей;
+* курсор и счетчики сохраняются раз в ``checkpoint_interval``, после
+  рестарта задание продолжается с курсора (при падении повторно могут уйти
+  сообщения, отправленные после последнего сохранения).
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from outbound import PRIORITY_BROADCAST, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_CANCELLED = 'cancelled'
+
+# Ошибки BadRequest, после которых писать в чат бессмысленно
+GONE_CHAT_ERRORS = ("chat not found", "user not found", "peer_id_invalid")
+
+
+class BroadcastStore:
+    """Получатели и задания рассылки в SQLite. Методы вызываются из одного потока."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            # timeout: в многопроцессном режиме в базу пишут все воркеры
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS recipients ("
+                "chat_id INTEGER PRIMARY KEY, quiz_id TEXT, completed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS broadcasts ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, "
+                "status TEXT NOT NULL, cursor INTEGER NOT NULL DEFAULT 0, "
+                "total INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, "
+                "failed INTEGER NOT NULL DEFAULT 0, pruned INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, finished_at REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def add_recipients(self, recipients):
+        """``recipients`` - словарь chat_id -> (id опроса, время завершения)."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO recipients (chat_id, quiz_id, completed_at) VALUES (?, ?, ?)",
+                    [(chat_id, quiz_id, completed_at)
+                     for chat_id, (quiz_id, completed_at) in recipients.items()]
+                )
+
+    def remove_recipient(self, chat_id):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM recipients WHERE chat_id = ?", (chat_id,))
+
+    def count_recipients(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM recipients").fetchone()[0]
+
+    def next_recipients(self, cursor, limit):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT chat_id FROM recipients WHERE chat_id > ? ORDER BY chat_id LIMIT ?",
+                (cursor, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def create_job(self, text):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                # Курсор ниже любого chat_id: id групп и каналов отрицательные
+                total = conn.execute("SELECT COUNT(*) FROM recipients").fetchone()[0]
+                cursor = conn.execute(
+                    "INSERT INTO broadcasts (text, status, cursor, total, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (text, STATUS_RUNNING, -(1 << 62), total, time.time())
+                )
+            return cursor.lastrowid
+
+    def next_job(self):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT * FROM broadcasts WHERE status = ? ORDER BY id LIMIT 1", (STATUS_RUNNING,)
+            ).fetchone()
+        return self._job(row)
+
+    def recent_jobs(self, limit=5):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def _job(self, row):
+        if row is None:
+            return None
+        names = ("id", "text", "status", "cursor", "total", "sent", "failed", "pruned",
+                 "created_at", "finished_at")
+        return dict(zip(names, row))
+
+    def checkpoint(self, job_id, cursor, sent, failed, pruned, status=None):
+        """Сохраняет прогресс задания и возвращает его текущий статус.
+
+        Статус мог поменяться из другого процесса (отмена командой).
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, pruned = ? WHERE id = ?",
+                    (cursor, sent, failed, pruned, job_id)
+                )
+                if status is not None:
+                    conn.execute(
+                        "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                        (status, time.time(), job_id, STATUS_RUNNING)
+                    )
+                row = conn.execute("SELECT status FROM broadcasts WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else STATUS_CANCELLED
+
+    def cancel_job(self, job_id):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                changed = conn.execute(
+                    "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                    (STATUS_CANCELLED, time.time(), job_id, STATUS_RUNNING)
+                ).rowcount
+        return changed > 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class BroadcastEngine:
+    def __init__(self, store, outbound, concurrency=5, rate=20.0, flush_interval=2.0,
+                 checkpoint_interval=1.0, poll_interval=5.0, page_size=500):
+        self.store = store
+        self.outbound = outbound
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.poll_interval = poll_interval
+        self.page_size = page_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast-store")
+        self._pending_recipients = {}
+        self._flush_timer = None
+        self._flush_tasks = set()
+        self._runner = None
+        self._wakeup = None
+        self._bucket = None
+        self._paused_until = 0.0
+        self.in_flight = 0
+        self.job = None  # выполняемое задание
+        self.recorded = 0
+        self.sent = 0
+        self.failed = 0
+        self.pruned = 0
+        self.flood_pauses = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # --- Получатели ---
+
+    def add_recipient(self, chat_id, quiz_id):
+        """Запоминает участника опроса; запись в базу - пачкой в фоне."""
+        self._pending_recipients[chat_id] = (quiz_id, time.time())
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._start_flush
+            )
+
+    def _start_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush_recipients())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush_recipients(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        recipients, self._pending_recipients = self._pending_recipients, {}
+        if not recipients:
+            return
+        try:
+            await self._run(self.store.add_recipients, recipients)
+            self.recorded += len(recipients)
+        except Exception as e:
+            logger.error(f"Error saving broadcast recipients: {e}", exc_info=True)
+            for chat_id, value in recipients.items():
+                self._pending_recipients.setdefault(chat_id, value)
+
+    # --- Задания ---
+
+    async def create(self, text):
+        # Только что закончившие опрос тоже должны попасть в рассылку
+        await self.flush_recipients()
+        job_id = await self._run(self.store.create_job, text)
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id
+
+    async def cancel(self, job_id):
+        return await self._run(self.store.cancel_job, job_id)
+
+    async def recent(self, limit=5):
+        """Последние задания и текущее число получателей."""
+        jobs = await self._run(self.store.recent_jobs, limit)
+        return jobs, await self._run(self.store.count_recipients)
+
+    def start(self, run_jobs=True):
+        """Запускает выполнение заданий. Без ``run_jobs`` движок только пишет получателей."""
+        if not run_jobs:
+            return
+        self._wakeup = asyncio.Event()
+        self._bucket = TokenBucket(self.rate, max(1.0, min(self.rate, self.concurrency)))
+        self._runner = asyncio.create_task(self._run_jobs(), name="broadcast-runner")
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        # Запись, запущенная таймером, должна закончиться до закрытия базы
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush_recipients()
+        await self._run(self.store.close)
+        self._executor.shutdown(wait=True)
+
+    async def _run_jobs(self):
+        while True:
+            try:
+                job = await self._run(self.store.next_job)
+                if job is not None:
+                    await self._run_job(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast runner error: {e}", exc_info=True)
+            self._wakeup.clear()
+            try:
+                # Задание могли создать в другом процессе - проверяем базу и по таймеру
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job):
+        self.job = job
+        job_id, cursor = job["id"], job["cursor"]
+        logger.info(f"Broadcast {job_id}: {job['total']} recipients, resuming after chat {cursor}")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_checkpoint = time.monotonic()
+        status = STATUS_RUNNING
+        in_order = deque()  # (chat_id, task) в порядке курсора
+        try:
+            while status == STATUS_RUNNING:
+                chat_ids = await self._run(self.store.next_recipients, cursor, self.page_size)
+                if not chat_ids:
+                    status = STATUS_DONE
+                    break
+                for chat_id in chat_ids:
+                    await semaphore.acquire()
+                    await self._pace()
+                    task = asyncio.create_task(self._send(job, chat_id))
+                    task.add_done_callback(lambda _: semaphore.release())
+                    in_order.append((chat_id, task))
+                    # Курсор двигается только по непрерывно обработанному началу
+                    while in_order and in_order[0][1].done():
+                        cursor = in_order.popleft()[0]
+                    if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                        last_checkpoint = time.monotonic()
+                        status = await self._checkpoint(job, cursor)
+                        if status != STATUS_RUNNING:
+                            break
+                await asyncio.gather(*(task for _, task in in_order))
+                if in_order:
+                    cursor = in_order[-1][0]
+                    in_order.clear()
+                status = await self._checkpoint(job, cursor)
+        except asyncio.CancelledError:
+            # Бот останавливается: сохраняем курсор, задание продолжится после рестарта
+            while in_order and in_order[0][1].done():
+                cursor = in_order.popleft()[0]
+            await self._checkpoint(job, cursor)
+            raise
+        finally:
+            self.job = None
+        if status == STATUS_DONE:
+            status = await self._checkpoint(job, cursor, STATUS_DONE)
+        logger.info(
+            f"Broadcast {job_id} {status}: sent={job['sent']}, failed={job['failed']}, pruned={job['pruned']}"
+        )
+
+    async def _checkpoint(self, job, cursor, status=None):
+        job["cursor"] = cursor
+        return await self._run(
+            self.store.checkpoint, job["id"], cursor, job["sent"], job["failed"], job["pruned"], status
+        )
+
+    async def _pace(self):
+        """Ждет паузы после флуд-лимита, токена скорости и пустой очереди ответов опроса."""
+        while True:
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self._bucket.delay(now))
+            # Все, что в очереди исходящих сверх наших сообщений, - живой трафик
+            if delay <= 0 and self.outbound.pending <= self.in_flight:
+                self._bucket.consume(now)
+                return
+            await asyncio.sleep(max(delay, 0.05))
+
+    async def _send(self, job, chat_id):
+        self.in_flight += 1
+        try:
+            while True:
+                try:
+                    await self.outbound.send(chat_id, job["text"], PRIORITY_BROADCAST)
+                except RetryAfter as e:
+                    # Планировщик уже исчерпал повторы - притормаживаем всю рассылку
+                    self.flood_pauses += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                    logger.warning(f"Broadcast {job['id']} paused for {e.retry_after}s by flood limit")
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except Forbidden as e:
+                    await self._prune(job, chat_id, e)
+                except BadRequest as e:
+                    if any(error in str(e).lower() for error in GONE_CHAT_ERRORS):
+                        await self._prune(job, chat_id, e)
+                    else:
+                        self._failed(job, chat_id, e)
+                except Exception as e:
+                    self._failed(job, chat_id, e)
+                else:
+                    job["sent"] += 1
+                    self.sent += 1
+                return
+        finally:
+            self.in_flight -= 1
+
+    async def _prune(self, job, chat_id, error):
+        # Бот заблокирован или аккаунт удален - больше этому чату не пишем
+        logger.info(f"Removing broadcast recipient {chat_id}: {error}")
+        job["pruned"] += 1
+        self.pruned += 1
+        try:
+            await self._run(self.store.remove_recipient, chat_id)
+        except Exception as e:
+            logger.error(f"Error removing broadcast recipient {chat_id}: {e}")
+
+    def _failed(self, job, chat_id, error):
+        logger.warning(f"Broadcast {job['id']} to chat {chat_id} failed: {error}")
+        job["failed"] += 1
+        self.failed += 1
+
+    def stats(self):
+        job = self.job
+        return {
+            "running_job": {
+                "id": job["id"],
+                "total": job["total"],
+                "sent": job["sent"],
+                "failed": job["failed"],
+                "pruned": job["pruned"],
+            } if job else None,
+            "in_flight": self.in_flight,
+            "pending_recipients": len(self._pending_recipients),
+            "recorded": self.recorded,
+            "sent": self.sent,
+            "failed": self.failed,
+            "pruned": self.pruned,
+            "flood_pauses": self.flood_pauses,
+        }
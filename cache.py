@@ -0,0 +1,126 @@
+"""Кэш с TTL для редко меняющихся данных Bot API (getMe, getWebhookInfo).
+
+Значение живет ``ttl`` секунд (свой срок для каждого ключа). Одновременные
+запросы одного ключа ждут один и тот же вызов загрузчика, так что поток
+команд /status превращается максимум в один запрос к Bot API за TTL.
+
+Если загрузка не удалась, а старое значение есть, отдается оно, и следующая
+попытка будет не раньше чем через ``error_ttl`` секунд. Ошибка без старого
+значения не кэшируется. ``invalidate`` и ``put`` во время загрузки
+побеждают: ее результат получат ожидающие, но в кэш он не попадет.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTTLCache:
+    def __init__(self, ttls=None, default_ttl=60.0, error_ttl=10.0):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.error_ttl = error_ttl
+        self._values = {}  # ключ -> (значение, время записи, срок годности)
+        self._inflight = {}  # ключ -> future текущей загрузки
+        # Меняются при invalidate/put; загрузка, начатая при другом поколении, не записывается
+        self._generations = {}
+        self._epoch = 0
+        self._refreshes = set()  # фоновые обновления: цикл событий держит задачи только по слабой ссылке
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _ttl(self, key):
+        return self.ttls.get(key, self.default_ttl)
+
+    def _fresh(self, key, now=None):
+        entry = self._values.get(key)
+        if entry is None:
+            return False
+        return (now or time.monotonic()) < entry[2]
+
+    def _generation(self, key):
+        return self._epoch, self._generations.get(key, 0)
+
+    def _store(self, key, value):
+        now = time.monotonic()
+        self._values[key] = (value, now, now + self._ttl(key))
+
+    async def get(self, key, loader):
+        """Значение из кэша или результат ``await loader()``, если оно устарело."""
+        if self._fresh(key):
+            self.hits += 1
+            return self._values[key][0]
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._load(key, loader, self._generation(key)))
+            self._inflight[key] = future
+        else:
+            self.hits += 1
+        # shield: отмена одного ожидающего не должна отменять загрузку для остальных
+        return await asyncio.shield(future)
+
+    async def _load(self, key, loader, generation):
+        try:
+            value = await loader()
+        except Exception as e:
+            self.errors += 1
+            entry = self._values.get(key)
+            if entry is None or self._generation(key) != generation:
+                raise
+            # Старое значение лучше ошибки; повторим не раньше чем через error_ttl
+            logger.warning(f"Cache load of {key!r} failed, serving stale value: {e}")
+            self._values[key] = (entry[0], entry[1], time.monotonic() + self.error_ttl)
+            return entry[0]
+        finally:
+            self._inflight.pop(key, None)
+        if self._generation(key) == generation:
+            self._store(key, value)
+        return value
+
+    def refresh(self, key, loader):
+        """Запускает фоновую загрузку устаревшего ключа. Вызывается на event loop."""
+        if self._fresh(key) or key in self._inflight:
+            return
+        task = asyncio.ensure_future(self.get(key, loader))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task):
+        self._refreshes.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Background cache refresh failed: {task.exception()}")
+
+    def put(self, key, value):
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._store(key, value)
+
+    def peek(self, key):
+        """(значение, возраст в секундах) без обращения к Bot API; (None, None), если пусто."""
+        entry = self._values.get(key)
+        if entry is None:
+            return None, None
+        return entry[0], time.monotonic() - entry[1]
+
+    def is_stale(self, key):
+        return not self._fresh(key)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._values.clear()
+            self._generations.clear()
+            self._epoch += 1
+        else:
+            self._values.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def stats(self):
+        return {
+            "keys": len(self._values),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
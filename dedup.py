@@ -0,0 +1,53 @@
+"""Отсев повторно доставленных обновлений по ``update_id``.
+
+Telegram повторяет доставку, если вебхук ответил медленно или с ошибкой.
+Последние ``capacity`` идентификаторов хранятся в кольцевом буфере
+фиксированного размера, поэтому память не растет со временем.
+"""
+
+
+class UpdateDeduplicator:
+    def __init__(self, capacity=4096):
+        self.capacity = max(1, capacity)
+        self._ring = [None] * self.capacity
+        self._position = 0
+        self._ids = set()
+        self.duplicates = 0
+
+    def __contains__(self, update_id):
+        return update_id in self._ids
+
+    def add(self, update_id):
+        if update_id in self._ids:
+            return
+        # Вытесняем самый старый идентификатор из кольца
+        oldest = self._ring[self._position]
+        if oldest is not None:
+            self._ids.discard(oldest)
+        self._ring[self._position] = update_id
+        self._ids.add(update_id)
+        self._position = (self._position + 1) % self.capacity
+
+    def discard(self, update_id):
+        """Забывает идентификатор, например если обновление не удалось поставить в очередь."""
+        if update_id not in self._ids:
+            return
+        self._ids.discard(update_id)
+        # Обычно это последняя запись; иначе ищем ее в кольце (редкий случай переполнения)
+        last = (self._position - 1) % self.capacity
+        index = last if self._ring[last] == update_id else self._ring.index(update_id)
+        self._ring[index] = None
+
+    def is_duplicate(self, update_id):
+        """Проверяет идентификатор и учитывает его в счетчике повторов."""
+        if update_id in self._ids:
+            self.duplicates += 1
+            return True
+        return False
+
+    def stats(self):
+        return {
+            "window": self.capacity,
+            "tracked": len(self._ids),
+            "duplicates": self.duplicates,
+        }
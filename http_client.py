@@ -0,0 +1,164 @@
+"""Общий слой исходящих HTTP-запросов: пул соединений, таймауты, статистика.
+
+Через него ходят и запросы к Bot API (``InstrumentedHTTPXRequest`` передается
+в ``Application.builder().request(...)``), и self-ping сервиса
+(``build_async_client``). Для каждого эндпоинта считаются количество
+запросов, ошибки и задержки, а также сколько соединений было открыто -
+отношение к числу запросов показывает, насколько хорошо они переиспользуются.
+"""
+import importlib.util
+import logging
+import time
+from contextlib import contextmanager
+
+import httpx
+from telegram.request import BaseRequest, HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointStats:
+    __slots__ = ("count", "errors", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class HttpStats:
+    def __init__(self, observer=None):
+        # observer(endpoint, seconds, error) - например, запись в гистограммы /metrics
+        self.observer = observer
+        self.endpoints = {}
+        self.requests = 0
+        self.connections_opened = 0
+
+    def observe(self, endpoint, seconds, error=False):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats()
+        stats.count += 1
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        if error:
+            stats.errors += 1
+        if self.observer:
+            self.observer(endpoint, seconds, error)
+
+    @contextmanager
+    def track(self, endpoint):
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.observe(endpoint, time.monotonic() - started, error=True)
+            raise
+        self.observe(endpoint, time.monotonic() - started)
+
+    async def on_request(self, request):
+        # Хук httpx: считаем запрос и подписываемся на события соединения httpcore
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    def snapshot(self):
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+            "endpoints": {
+                endpoint: {
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "avg_ms": round(stats.total_seconds / stats.count * 1000, 2) if stats.count else 0.0,
+                    "max_ms": round(stats.max_seconds * 1000, 2),
+                }
+                for endpoint, stats in self.endpoints.items()
+            },
+        }
+
+
+def resolve_http_version(http_version):
+    """HTTP/2 требует пакет h2 (``httpx[http2]``); без него остаемся на HTTP/1.1."""
+    if http_version in ("2", "2.0"):
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but h2 is not installed, falling back to HTTP/1.1")
+            return "1.1"
+        return "2"
+    return "1.1"
+
+
+def _limits(pool_size, keepalive_expiry):
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=keepalive_expiry
+    )
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """``HTTPXRequest`` с настраиваемым keep-alive и статистикой по методам Bot API."""
+
+    def __init__(self, stats, pool_size=32, keepalive_expiry=60.0, connect_timeout=5.0,
+                 read_timeout=10.0, write_timeout=10.0, pool_timeout=5.0, http_version="1.1"):
+        # Атрибуты нужны до super().__init__, который сразу строит клиент
+        self.stats = stats
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        super().__init__(
+            connection_pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            pool_timeout=pool_timeout,
+            http_version=resolve_http_version(http_version)
+        )
+
+    def _build_client(self):
+        kwargs = dict(self._client_kwargs)
+        kwargs["limits"] = _limits(self.pool_size, self.keepalive_expiry)
+        kwargs["event_hooks"] = {"request": [self.stats.on_request]}
+        return httpx.AsyncClient(**kwargs)
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        # URL вида .../bot<token>/<method> - в статистику попадает только имя метода
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.monotonic()
+        try:
+            code, payload = await super().do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception:
+            self.stats.observe(endpoint, time.monotonic() - started, error=True)
+            raise
+        # Ответы с ошибкой (например, 429) приходят кодом, исключение бросается выше по стеку
+        self.stats.observe(endpoint, time.monotonic() - started, error=code >= 400)
+        return code, payload
+
+
+def build_async_client(stats, pool_size=2, keepalive_expiry=60.0, timeout=10.0, http_version="1.1"):
+    """Клиент для прочих запросов (self-ping) с теми же настройками и статистикой."""
+    http1 = resolve_http_version(http_version) == "1.1"
+    return httpx.AsyncClient(
+        limits=_limits(pool_size, keepalive_expiry),
+        timeout=timeout,
+        http1=http1,
+        http2=not http1,
+        event_hooks={"request": [stats.on_request]}
+    )
@@ -0,0 +1,189 @@
+"""Логирование без блокировки event loop и потоков Flask.
+
+Записи логов не форматируются и не пишутся в поток прямо в обработчике:
+``QueueHandler`` кладет их в ограниченную очередь, а форматирует и пишет
+фоновый поток ``QueueListener``. Если очередь переполнена, запись
+отбрасывается и учитывается в счетчике (предупреждения и ошибки ждут места
+в очереди до секунды). О потерянных записях фоновый поток сам пишет
+предупреждение.
+
+Частые сообщения об отдельных обновлениях помечаются ``extra=HOT``; из них
+в лог попадает только доля ``sample_rate``. Предупреждения и ошибки
+сохраняются всегда.
+
+В формате ``json`` каждая запись - одна компактная JSON-строка с полями
+``update_id`` и ``chat_id`` обновления, которое обрабатывается в этот момент
+(задаются через ``bind_update``).
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Пометка частых сообщений, которые можно прореживать
+HOT = {"hot": True}
+
+update_id_var = contextvars.ContextVar("update_id", default=None)
+chat_id_var = contextvars.ContextVar("chat_id", default=None)
+
+
+def bind_update(update_id, chat_id):
+    """Привязывает следующие записи текущего контекста к обновлению; возвращает токены для ``unbind_update``."""
+    return update_id_var.set(update_id), chat_id_var.set(chat_id)
+
+
+def unbind_update(tokens):
+    update_id_var.reset(tokens[0])
+    chat_id_var.reset(tokens[1])
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи update_id и chat_id. Работает в потоке, создавшем запись."""
+
+    def filter(self, record):
+        if not hasattr(record, "update_id"):
+            record.update_id = update_id_var.get()
+        if not hasattr(record, "chat_id"):
+            record.chat_id = chat_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rate=1.0, hot_loggers=()):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.hot_loggers = frozenset(hot_loggers)
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1:
+            return True
+        if not getattr(record, "hot", False) and record.name not in self.hot_loggers:
+            return True
+        if random.random() < self.sample_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        update_id = getattr(record, "update_id", None)
+        if update_id is not None:
+            data["update_id"] = update_id
+        chat_id = getattr(record, "chat_id", None)
+        if chat_id is not None:
+            data["chat_id"] = chat_id
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # В потоке обработчика - только подстановка аргументов, чтобы запись не
+        # зависела от объектов, которые потом изменятся. JSON и traceback -
+        # в фоновом потоке.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                try:
+                    self.queue.put(record, timeout=1.0)
+                    return
+                except queue.Full:
+                    pass
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def __init__(self, log_queue, handler, pipeline):
+        super().__init__(log_queue, handler, respect_handler_level=True)
+        self.pipeline = pipeline
+        self._reported = 0
+        self._last_report = 0.0
+
+    def handle(self, record):
+        dropped = self.pipeline.queue_handler.dropped
+        if dropped != self._reported and time.monotonic() - self._last_report >= 10:
+            self._last_report = time.monotonic()
+            warning = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                f"Log queue overflow: {dropped - self._reported} records dropped", None, None
+            )
+            self._reported = dropped
+            super().handle(warning)
+        super().handle(record)
+
+
+class LogPipeline:
+    """Настроенный корневой логгер: фильтры, очередь и фоновый поток записи."""
+
+    def __init__(self, log_format="text", level=logging.INFO, queue_size=10000,
+                 sample_rate=1.0, hot_loggers=(), stream=None):
+        self.stream_handler = logging.StreamHandler(stream or sys.stderr)
+        self.stream_handler.setFormatter(
+            JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+        )
+        self.sampling = SamplingFilter(sample_rate, hot_loggers)
+        self.queue_handler = None
+        self.listener = None
+        if queue_size > 0:
+            self.queue_handler = BoundedQueueHandler(queue.Queue(queue_size))
+            self.listener = _Listener(self.queue_handler.queue, self.stream_handler, self)
+            handler = self.queue_handler
+        else:
+            handler = self.stream_handler
+        handler.addFilter(self.sampling)
+        handler.addFilter(ContextFilter())
+        self.handler = handler
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.listener:
+            self.listener.start()
+        return self
+
+    def stop(self):
+        """Дописывает накопленные записи. Повторный вызов ничего не делает."""
+        with self._lock:
+            if self.listener and self.listener._thread is not None:
+                self.listener.stop()
+
+    def stats(self):
+        return {
+            "queued": self.queue_handler.queue.qsize() if self.queue_handler else 0,
+            "dropped": self.queue_handler.dropped if self.queue_handler else 0,
+            "sampled_out": self.sampling.sampled_out,
+            "sample_rate": self.sampling.sample_rate,
+        }
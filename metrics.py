@@ -0,0 +1,239 @@
+"""Метрики в текстовом формате Prometheus.
+
+Запись должна быть почти бесплатной, чтобы метрики можно было держать
+включенными в проде: каждый поток пишет в свой собственный массив
+счетчиков (без блокировок на горячем пути), гистограммы имеют
+фиксированный набор бакетов. Массивы потоков суммируются только при
+чтении ``/metrics``, а массив завершившегося потока складывается в общую
+базу.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ShardHolder:
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self, values):
+        self.values = values
+
+
+class _ShardedValues:
+    """Массив значений, у каждого живого потока своя копия.
+
+    Когда поток завершается (во Flask с ``threaded=True`` - после каждого
+    запроса), его копия прибавляется к общей базе и забывается, так что
+    число копий не растет с числом запросов.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = {}  # id массива -> массив живого потока
+        self._base = [0] * size
+        self._lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self._local.holder.values
+        except AttributeError:
+            values = [0] * self._size
+            holder = _ShardHolder(values)
+            with self._lock:
+                self._shards[id(values)] = values
+            # Держатель живет, пока жив поток: threading.local освобождает его при завершении потока
+            weakref.finalize(holder, self._retire, values)
+            self._local.holder = holder
+            return values
+
+    def _retire(self, values):
+        with self._lock:
+            if self._shards.pop(id(values), None) is None:
+                return
+            for i, value in enumerate(values):
+                self._base[i] += value
+
+    def totals(self):
+        with self._lock:
+            totals = list(self._base)
+            shards = list(self._shards.values())
+        for values in shards:
+            for i, value in enumerate(values):
+                totals[i] += value
+        return totals
+
+
+class _CounterChild:
+    __slots__ = ("_values",)
+
+    def __init__(self):
+        self._values = _ShardedValues(1)
+
+    def inc(self, amount=1):
+        self._values.shard()[0] += amount
+
+    def value(self):
+        return self._values.totals()[0]
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_values")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # Счетчики по бакетам, затем +Inf, затем сумма наблюдений
+        self._values = _ShardedValues(len(buckets) + 2)
+
+    def observe(self, value):
+        values = self._values.shard()
+        values[bisect_left(self._buckets, value)] += 1
+        values[-1] += value
+
+    def snapshot(self):
+        totals = self._values.totals()
+        return totals[:-1], totals[-1]
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        """Дочерняя метрика для набора значений меток; ее стоит сохранить и переиспользовать."""
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    child = self._children[labelvalues] = self._new_child()
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = self.header()
+        for labelvalues, child in list(self._children.items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value())}"
+            )
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = self.header()
+        for labelvalues, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, ('le', le))} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Значение вычисляется при чтении: ``callback`` возвращает число
+    или словарь {кортеж значений меток: число}."""
+
+    def __init__(self, name, documentation, callback, labelnames=(), type_name="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type_name = type_name
+
+    def render(self):
+        lines = self.header()
+        value = self.callback()
+        if isinstance(value, dict):
+            for labelvalues, item in value.items():
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(item)}"
+                )
+        elif value is not None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, labelnames=(), type_name="gauge"):
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, type_name))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
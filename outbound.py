@@ -0,0 +1,324 @@
+"""Планировщик исходящих сообщений с учетом лимитов Telegram.
+
+Все отправки идут через одну очередь:
+
+* токен-бакеты ограничивают общую скорость (~30 сообщений/с) и скорость
+  в один чат (~1 сообщение/с с небольшим запасом на всплески);
+* при ``RetryAfter`` чат ставится на паузу на указанное Telegram время,
+  а сообщения остаются в очереди; если за ``flood_window`` секунд лимит
+  получили ``flood_chats`` разных чатов, значит Telegram ограничивает бота
+  целиком, и на паузу встает вся отправка;
+* сообщения с меньшим приоритетом (уведомления) уступают ответам опроса;
+* идущие подряд текстовые сообщения в один чат склеиваются в одно, если
+  это не меняет итоговую клавиатуру и разметку.
+
+Порядок сообщений внутри одного чата сохраняется.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram import ReplyKeyboardRemove
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_QUIZ = 0  # ответы пользователю в диалоге
+PRIORITY_DEFAULT = 1
+PRIORITY_NOTIFICATION = 2
+PRIORITY_BROADCAST = 3  # рассылки уступают всему остальному
+
+MARKDOWN_SPECIAL_CHARS = frozenset("_*`[")
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен (0 - доступен сейчас)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "method", "kwargs", "priority", "futures", "enqueued_at", "attempts")
+
+    def __init__(self, chat_id, method, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.futures = [future]
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+def _can_merge(first, second):
+    """Можно ли отправить ``second`` в одном сообщении с ``first``."""
+    if first.method != 'send_message' or second.method != 'send_message':
+        return False
+    # Сообщения разной важности не склеиваются: рассылка не должна попасть в
+    # ответ опроса и получить его приоритет
+    if first.priority != second.priority:
+        return False
+    a, b = first.kwargs, second.kwargs
+    if set(a) - {'text', 'parse_mode', 'reply_markup', 'disable_web_page_preview'}:
+        return False
+    if set(b) - {'text', 'parse_mode', 'reply_markup', 'disable_web_page_preview'}:
+        return False
+    if a.get('disable_web_page_preview') != b.get('disable_web_page_preview'):
+        return False
+    # Итоговая клавиатура берется из второго сообщения
+    markup = a.get('reply_markup')
+    if markup is not None and not isinstance(markup, ReplyKeyboardRemove) and markup != b.get('reply_markup'):
+        return False
+    if a.get('parse_mode') != b.get('parse_mode'):
+        # Текст без разметки можно склеить с размеченным, если в нем нет спецсимволов
+        plain = a if a.get('parse_mode') is None else b
+        if MARKDOWN_SPECIAL_CHARS.intersection(plain['text']):
+            return False
+    return len(a['text']) + len(b['text']) + 2 <= MessageLimit.MAX_TEXT_LENGTH
+
+
+def _merge(first, second):
+    kwargs = dict(second.kwargs)
+    kwargs['text'] = f"{first.kwargs['text']}\n\n{second.kwargs['text']}"
+    kwargs['parse_mode'] = first.kwargs.get('parse_mode') or second.kwargs.get('parse_mode')
+    first.kwargs = kwargs
+    first.futures.extend(second.futures)
+
+
+class OutboundScheduler:
+    def __init__(self, bot, global_rate=30.0, chat_rate=1.0, chat_burst=3,
+                 max_retries=3, coalesce=True, flood_chats=3, flood_window=1.0):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+
+        self._chats = {}  # chat_id -> deque исходящих сообщений
+        self._chat_buckets = {}
+        self._paused_until = {}  # chat_id -> monotonic время окончания паузы после 429
+        self.flood_chats = max(1, flood_chats)
+        self.flood_window = flood_window
+        self._floods = deque()  # (время, chat_id) недавних 429
+        self._global_paused_until = 0.0
+        self._ready = []  # куча (приоритет, порядковый номер, chat_id)
+        self._scheduled = set()  # чаты, которые в куче, отправляются или ждут таймера
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._idle = None  # установлено, когда все сообщения отправлены
+        self._dispatcher = None
+        self._deliveries = set()
+
+        self.pending = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.global_pauses = 0
+        self.failed = 0
+        self.dispatched = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-dispatcher")
+
+    async def stop(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    async def drain(self, timeout):
+        """Ждет отправки всей очереди. False, если не успели за ``timeout`` секунд."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def submit(self, chat_id, method='send_message', priority=PRIORITY_DEFAULT, **kwargs):
+        """Ставит вызов Bot API в очередь и возвращает future с его результатом."""
+        future = asyncio.get_running_loop().create_future()
+        self._chats.setdefault(chat_id, deque()).append(
+            OutboundMessage(chat_id, method, kwargs, priority, future)
+        )
+        self.pending += 1
+        self._idle.clear()
+        if chat_id not in self._scheduled:
+            self._make_ready(chat_id)
+        return future
+
+    async def send(self, chat_id, text, priority=PRIORITY_DEFAULT, **kwargs):
+        return await self.submit(chat_id, 'send_message', priority, text=text, **kwargs)
+
+    async def send_many(self, chat_id, messages, priority=PRIORITY_DEFAULT):
+        """Отправляет несколько сообщений подряд; соседние могут быть склеены.
+
+        ``messages`` - список словарей с аргументами ``send_message``.
+        Возвращает результат последнего сообщения.
+        """
+        futures = [self.submit(chat_id, 'send_message', priority, **kwargs) for kwargs in messages]
+        results = await asyncio.gather(*futures)
+        return results[-1]
+
+    async def call(self, chat_id, method, priority=PRIORITY_DEFAULT, **kwargs):
+        """Любой вызов Bot API, который расходует лимит чата (например, edit_message_text)."""
+        return await self.submit(chat_id, method, priority, **kwargs)
+
+    def stats(self):
+        return {
+            "queue_depth": self.pending,
+            "waiting_chats": len(self._chats),
+            "paused_chats": len(self._paused_until),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "global_pauses": self.global_pauses,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.wait_total / self.dispatched * 1000, 2) if self.dispatched else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 2),
+        }
+
+    def _make_ready(self, chat_id):
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._scheduled.discard(chat_id)
+            self._chats.pop(chat_id, None)
+            return
+        self._scheduled.add(chat_id)
+        heapq.heappush(self._ready, (queue[0].priority, next(self._seq), chat_id))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._ready:
+                self._prune_buckets()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = max(self.global_bucket.delay(now), self._global_paused_until - now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat_delay = max(
+                self._chat_bucket(chat_id).delay(now),
+                self._paused_until.get(chat_id, now) - now
+            )
+            if chat_delay > 0:
+                # Чат ждет своего лимита, не задерживая остальные
+                loop.call_later(chat_delay, self._make_ready, chat_id)
+                continue
+            self._paused_until.pop(chat_id, None)
+
+            queue = self._chats[chat_id]
+            message = queue.popleft()
+            while self.coalesce and queue and _can_merge(message, queue[0]):
+                _merge(message, queue.popleft())
+                self.coalesced += 1
+
+            self.global_bucket.consume(now)
+            self._chat_bucket(chat_id).consume(now)
+            waited = now - message.enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.dispatched += 1
+            task = asyncio.create_task(self._deliver(message))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, message):
+        chat_id = message.chat_id
+        try:
+            message.attempts += 1
+            result = await getattr(self.bot, message.method)(chat_id=chat_id, **message.kwargs)
+        except RetryAfter as e:
+            self._record_flood(chat_id, e.retry_after)
+            if message.attempts <= self.max_retries:
+                self.retries += 1
+                logger.warning(f"Flood limit for chat {chat_id}, retrying in {e.retry_after}s")
+                self._paused_until[chat_id] = time.monotonic() + e.retry_after
+                self._chats.setdefault(chat_id, deque()).appendleft(message)
+                self._make_ready(chat_id)
+                return
+            self._finish(message, exception=e)
+        except Exception as e:
+            self._finish(message, exception=e)
+        else:
+            self._finish(message, result=result)
+        self._make_ready(chat_id)
+
+    def _record_flood(self, chat_id, retry_after):
+        """Ставит на паузу всю отправку, если лимит получили сразу несколько чатов."""
+        now = time.monotonic()
+        self._floods.append((now, chat_id))
+        while self._floods and now - self._floods[0][0] > self.flood_window:
+            self._floods.popleft()
+        if len({flooded for _, flooded in self._floods}) < self.flood_chats:
+            return
+        until = now + retry_after
+        if until > self._global_paused_until:
+            self._global_paused_until = until
+            self.global_pauses += 1
+            logger.warning(f"Flood limit hit by {self.flood_chats}+ chats, pausing all sends for {retry_after}s")
+        self._floods.clear()
+
+    def _prune_buckets(self):
+        # Полные бакеты ничего не ограничивают - их можно забыть
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in self._scheduled and bucket.delay(now) == 0
+                        and bucket.tokens >= bucket.capacity]:
+            del self._chat_buckets[chat_id]
+
+    def _finish(self, message, result=None, exception=None):
+        self.pending -= len(message.futures)
+        if not self.pending:
+            self._idle.set()
+        if exception is not None:
+            self.failed += 1
+        else:
+            self.sent += 1
+        for future in message.futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
@@ -0,0 +1,299 @@
+"""Опросы из файлов определений: компиляция и горячая перезагрузка.
+
+Каждый файл в каталоге опросов (``*.json``, а если установлен PyYAML - и
+``*.yaml``/``*.yml``) описывает один опрос: вступление, вопросы, шкалу
+ответов и диапазоны баллов с текстами результатов. При загрузке
+определение компилируется: тексты вопросов и результатов подставляются
+заранее, клавиатуры собираются один раз, а текст результата по сумме
+баллов берется из таблицы по индексу.
+
+``QuizRegistry`` перечитывает каталог, когда файлы меняются. Новый набор
+опросов подменяется целиком и только если скомпилировались все
+определения. Версия опроса - хеш его файла; прежние версии остаются
+доступны по ссылке ``id@version``, поэтому начатый опрос доходит до конца
+по той версии, с которой начался.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+from sessions import MAX_QUESTIONS, MAX_SCORE
+
+try:
+    import yaml
+except ImportError:  # YAML не обязателен, JSON поддерживается всегда
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUESTION_FORMAT = "*{number}.* *{text}*"
+# callback_data inline-кнопок: "q<номер вопроса>:<балл>"
+INLINE_ANSWER_PATTERN = r"^q\d+:\d$"
+
+
+class QuizDefinitionError(ValueError):
+    pass
+
+
+class _Placeholders(dict):
+    # Неизвестные подстановки (например, {first_name}) остаются до отправки
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def render(text, values):
+    return text.format_map(_Placeholders(values))
+
+
+class Quiz:
+    """Скомпилированный опрос: все тексты и клавиатуры готовы к отправке."""
+
+    __slots__ = ("id", "version", "ref", "title", "start_button", "intro", "questions",
+                 "reply_markup", "inline_markups", "invalid_answer", "_scores", "_valid_scores",
+                 "_lowest_total", "_results")
+
+    def __init__(self, quiz_id, version, title, start_button, intro, questions,
+                 scale, invalid_answer, lowest_total, results):
+        self.id = quiz_id
+        self.version = version
+        self.ref = f"{quiz_id}@{version}"
+        self.title = title
+        self.start_button = start_button
+        self.intro = intro
+        self.questions = tuple(questions)
+        self.invalid_answer = invalid_answer
+        labels = [label for label, _ in scale]
+        self._scores = dict(scale)
+        self._valid_scores = frozenset(self._scores.values())
+        self.reply_markup = ReplyKeyboardMarkup([labels], one_time_keyboard=True, resize_keyboard=True)
+        self.inline_markups = tuple(
+            InlineKeyboardMarkup([[
+                InlineKeyboardButton(label, callback_data=f"q{index}:{score}")
+                for label, score in scale
+            ]])
+            for index in range(len(self.questions))
+        )
+        # Тексты результатов для сумм от lowest_total до максимальной
+        self._lowest_total = lowest_total
+        self._results = tuple(results)
+
+    def greeting(self, first_name):
+        return self.intro.replace("{first_name}", first_name or "")
+
+    def is_valid_score(self, score):
+        """Есть ли такой балл на шкале опроса."""
+        return score in self._valid_scores
+
+    def parse_answer(self, text):
+        """Балл из текста ответа или None, если ответ некорректный."""
+        score = self._scores.get(text)
+        if score is not None:
+            return score
+        # Свободный текст: принимаем "3" или "3 что угодно", если такой балл есть на шкале
+        parts = text.split()
+        # isdecimal, а не isdigit: "²" - цифра, но int() ее не разберет
+        if parts and parts[0].isdecimal() and self.is_valid_score(int(parts[0])):
+            return int(parts[0])
+        return None
+
+    def result_text(self, total):
+        index = total - self._lowest_total
+        return self._results[min(max(index, 0), len(self._results) - 1)]
+
+
+def compile_quiz(definition, version, values=None):
+    """Проверяет определение опроса и собирает из него ``Quiz``."""
+    values = dict(values or {})
+
+    def field(name, kind, required=True, default=None):
+        value = definition.get(name, default)
+        if value is None and not required:
+            return None
+        if not isinstance(value, kind):
+            raise QuizDefinitionError(f"Field {name!r} must be {kind.__name__}")
+        return value
+
+    quiz_id = field("id", str)
+    title = field("title", str, required=False) or quiz_id
+    questions = field("questions", list)
+    if not 0 < len(questions) <= MAX_QUESTIONS:
+        raise QuizDefinitionError(f"Quiz {quiz_id!r} must have 1..{MAX_QUESTIONS} questions")
+    question_format = field("question_format", str, required=False) or DEFAULT_QUESTION_FORMAT
+
+    scale = []
+    for option in field("scale", list):
+        label, score = option.get("label"), option.get("score")
+        if not isinstance(label, str) or not isinstance(score, int) or not 0 <= score <= MAX_SCORE:
+            raise QuizDefinitionError(f"Quiz {quiz_id!r}: scale options need a label and a score 0..{MAX_SCORE}")
+        scale.append((label, score))
+    if not scale or len({label for label, _ in scale}) != len(scale):
+        raise QuizDefinitionError(f"Quiz {quiz_id!r}: scale labels must be present and unique")
+
+    scores = [score for _, score in scale]
+    lowest, highest = min(scores) * len(questions), max(scores) * len(questions)
+    bands = sorted(field("results", list), key=lambda band: band.get("min_score", 0), reverse=True)
+    if not bands:
+        raise QuizDefinitionError(f"Quiz {quiz_id!r}: results must not be empty")
+    header = render(field("result_header", str, required=False) or "", values)
+    texts = [(band.get("min_score", 0), header + render(band["text"], values)) for band in bands]
+    # Таблица "сумма баллов -> текст результата" на все достижимые суммы
+    results = [
+        next((text for min_score, text in texts if total >= min_score), None)
+        for total in range(lowest, highest + 1)
+    ]
+    if None in results:
+        raise QuizDefinitionError(f"Quiz {quiz_id!r}: results must cover every total {lowest}..{highest}")
+
+    return Quiz(
+        quiz_id,
+        version,
+        title,
+        field("start_button", str, required=False),
+        render(field("intro", str, required=False) or "", values),
+        [
+            render(question_format, dict(values, number=number, text=text))
+            for number, text in enumerate(questions, 1)
+        ],
+        scale,
+        render(field("invalid_answer", str, required=False) or "Пожалуйста, выберите вариант ответа", values),
+        lowest,
+        results
+    )
+
+
+def _parse_definition(path, raw):
+    if path.endswith(".json"):
+        return json.loads(raw)
+    return yaml.safe_load(raw)
+
+
+class QuizRegistry:
+    def __init__(self, directory, values=None, required=(), keep_versions=8, on_reload=None):
+        self.directory = directory
+        self.values = dict(values or {})
+        self.required = tuple(required)
+        self.keep_versions = keep_versions
+        self.on_reload = on_reload
+        self._current = {}  # id -> Quiz
+        self._start_buttons = {}  # подпись кнопки -> id опроса
+        self._versions = OrderedDict()  # ref -> Quiz, включая прежние версии
+        self._signature = None
+        self.reloads = 0
+        self.errors = 0
+
+    def _files(self):
+        extensions = (".json", ".yaml", ".yml") if yaml else (".json",)
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(extensions)
+        )
+
+    def _current_signature(self):
+        signature = []
+        for path in self._files():
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def load(self):
+        """Компилирует все определения и подменяет набор опросов целиком.
+
+        При ошибке в любом файле текущий набор остается прежним. Возвращает
+        True, если набор обновлен.
+        """
+        signature = self._current_signature()
+        compiled = {}
+        try:
+            for path in (entry[0] for entry in signature):
+                with open(path, "rb") as file:
+                    raw = file.read()
+                version = hashlib.sha1(raw).hexdigest()[:10]
+                quiz = compile_quiz(_parse_definition(path, raw), version, self.values)
+                if quiz.id in compiled:
+                    raise QuizDefinitionError(f"Duplicate quiz id {quiz.id!r} in {path}")
+                compiled[quiz.id] = quiz
+            missing = [quiz_id for quiz_id in self.required if quiz_id not in compiled]
+            if missing:
+                raise QuizDefinitionError(f"Required quizzes missing in {self.directory}: {', '.join(missing)}")
+            if not compiled:
+                raise QuizDefinitionError(f"No quiz definitions in {self.directory}")
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.errors += 1
+            self._signature = signature
+            if not self._current:
+                raise
+            logger.error(f"Quiz definitions not reloaded, keeping the current ones: {e}")
+            return False
+
+        self._signature = signature
+        self._current = compiled
+        self._start_buttons = {
+            quiz.start_button: quiz.id for quiz in compiled.values() if quiz.start_button
+        }
+        for quiz in compiled.values():
+            self._versions[quiz.ref] = quiz
+            self._versions.move_to_end(quiz.ref)
+        self._trim_versions()
+        self.reloads += 1
+        logger.info(
+            "Loaded quizzes: " + ", ".join(quiz.ref for quiz in compiled.values())
+        )
+        if self.on_reload:
+            self.on_reload(self)
+        return True
+
+    def _trim_versions(self):
+        counts = {}
+        for ref in reversed(list(self._versions)):
+            quiz = self._versions[ref]
+            counts[quiz.id] = counts.get(quiz.id, 0) + 1
+            if counts[quiz.id] > self.keep_versions:
+                del self._versions[ref]
+
+    def reload_if_changed(self):
+        if self._current_signature() != self._signature:
+            return self.load()
+        return False
+
+    async def watch(self, interval):
+        """Проверяет каталог раз в ``interval`` секунд и перезагружает опросы при изменениях."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error checking quiz definitions: {e}", exc_info=True)
+
+    def get(self, quiz_id):
+        return self._current.get(quiz_id)
+
+    def resolve(self, ref, default_id=None):
+        """Опрос по ссылке ``id@version``; если версия уже выгружена - текущая версия того же опроса."""
+        if ref:
+            quiz = self._versions.get(ref)
+            if quiz is not None:
+                return quiz
+            return self._current.get(ref.partition("@")[0])
+        return self._current.get(default_id)
+
+    @property
+    def quizzes(self):
+        return self._current
+
+    def start_buttons(self):
+        return self._start_buttons
+
+    def stats(self):
+        return {
+            "quizzes": {quiz.id: quiz.version for quiz in self._current.values()},
+            "versions_kept": len(self._versions),
+            "reloads": self.reloads,
+            "errors": self.errors,
+        }
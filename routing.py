@@ -0,0 +1,50 @@
+"""Маршрутизация текстов кнопок по точному совпадению.
+
+Подписи кнопок - фиксированные строки из определений клавиатур, поэтому
+вместо цепочки ``filters.Regex`` достаточно одного поиска в хеш-таблице.
+Регулярные выражения и общий обход фильтров остаются только для
+свободного текста.
+"""
+from telegram import KeyboardButton
+from telegram.ext import filters
+
+
+def keyboard_labels(keyboard):
+    """Подписи всех кнопок клавиатуры (строки или ``KeyboardButton``) по порядку."""
+    return [
+        button.text if isinstance(button, KeyboardButton) else button
+        for row in keyboard
+        for button in row
+    ]
+
+
+class ExactTextFilter(filters.MessageFilter):
+    """Пропускает сообщения, текст которых в точности совпадает с одной из строк."""
+
+    __slots__ = ("texts",)
+
+    def __init__(self, texts, name=None):
+        self.texts = frozenset(texts)
+        super().__init__(name=name or f"ExactTextFilter({len(self.texts)} texts)")
+
+    def filter(self, message):
+        return message.text in self.texts
+
+
+def build_text_routes(keyboard, actions, handled_elsewhere=()):
+    """Таблица подпись кнопки -> обработчик, построенная по определению клавиатуры.
+
+    ``actions`` сопоставляет подписи обработчикам; кнопка клавиатуры без
+    обработчика - ошибка конфигурации, ее лучше поймать при старте.
+    Кнопки из ``handled_elsewhere`` обрабатывают другие обработчики (например,
+    точка входа разговора), в таблицу они не попадают.
+    """
+    handled_elsewhere = frozenset(handled_elsewhere)
+    routes = {}
+    for label in keyboard_labels(keyboard):
+        if label in handled_elsewhere:
+            continue
+        if label not in actions:
+            raise ValueError(f"No handler for keyboard button {label!r}")
+        routes[label] = actions[label]
+    return routes
@@ -0,0 +1,138 @@
+"""Планировщик обработки обновлений: параллельно по чатам, строго по порядку внутри чата.
+
+Разные чаты обрабатываются одновременно (не больше ``concurrency`` штук),
+а обновления одного чата - строго последовательно, поэтому состояние
+``ConversationHandler`` остается корректным. Входная очередь ограничена
+``max_pending`` обновлениями: когда она заполнена, ``submit`` либо сразу
+отказывает, либо ждет освобождения места не дольше ``timeout``.
+"""
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Поведение при переполнении входной очереди
+OVERFLOW_REJECT = 'reject'  # сразу отказать (вебхук вернет 503, Telegram повторит позже)
+OVERFLOW_WAIT = 'wait'  # подождать освобождения места, затем отказать
+
+
+class ChatOrderedScheduler:
+    def __init__(self, handler, concurrency=16, max_pending=1000,
+                 overflow_policy=OVERFLOW_WAIT, enqueue_timeout=2.0):
+        if overflow_policy not in (OVERFLOW_REJECT, OVERFLOW_WAIT):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self._handler = handler
+        self.concurrency = max(1, concurrency)
+        self.max_pending = max(1, max_pending)
+        self.overflow_policy = overflow_policy
+        self.enqueue_timeout = enqueue_timeout
+
+        self._chats = {}  # ключ чата -> deque ожидающих обновлений
+        self._ready = None  # очередь ключей чатов, готовых к обработке
+        self._not_full = None
+        self._idle = None  # установлено, когда очередь пуста
+        self._workers = []
+        self.pending = 0
+        self.in_flight = 0
+        self.rejected = 0
+
+    def start(self):
+        self._ready = asyncio.Queue()
+        self._not_full = asyncio.Condition()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"update-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(
+            f"Update scheduler started: concurrency={self.concurrency}, "
+            f"queue size={self.max_pending}, overflow={self.overflow_policy}"
+        )
+
+    async def stop(self):
+        """Останавливает воркеры; после этого новые обновления не принимаются."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def drain(self, timeout):
+        """Ждет, пока будут обработаны все принятые обновления. False, если не успели за ``timeout``."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def try_submit(self, key, item):
+        """Ставит обновление в очередь без ожидания. Возвращает False, если места нет или планировщик остановлен."""
+        if not self._workers or self.pending >= self.max_pending:
+            return False
+        self._enqueue(key, item)
+        return True
+
+    async def submit(self, key, item):
+        """Ставит обновление в очередь согласно политике переполнения."""
+        if self.try_submit(key, item):
+            return True
+        if self.overflow_policy == OVERFLOW_WAIT:
+            try:
+                async with self._not_full:
+                    await asyncio.wait_for(
+                        self._not_full.wait_for(lambda: self.pending < self.max_pending),
+                        self.enqueue_timeout
+                    )
+                # За время ожидания планировщик могли остановить
+                if self._workers:
+                    self._enqueue(key, item)
+                    return True
+            except asyncio.TimeoutError:
+                pass
+        self.rejected += 1
+        return False
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "active_chats": len(self._chats),
+            "max_pending": self.max_pending,
+            "concurrency": self.concurrency,
+            "rejected": self.rejected,
+        }
+
+    def _enqueue(self, key, item):
+        self.pending += 1
+        self._idle.clear()
+        queue = self._chats.get(key)
+        if queue is None:
+            # Чат не обрабатывается и не ждет воркера - отдаем его в работу
+            self._chats[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            queue.append(item)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._chats[key]
+            item = queue.popleft()
+            self.in_flight += 1
+            try:
+                await self._handler(item)
+            except Exception as e:
+                logger.error(f"Error in update worker: {e}", exc_info=True)
+            finally:
+                self.in_flight -= 1
+                self.pending -= 1
+                if not self.pending:
+                    self._idle.set()
+                # Чат возвращается в конец очереди, чтобы не занимать воркер надолго
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                async with self._not_full:
+                    self._not_full.notify()
@@ -0,0 +1,235 @@
+"""Сессии опроса: компактное состояние и вытеснение неактивных.
+
+Прогресс опроса хранится в ``user_data`` одним целым числом: младшие
+``INDEX_BITS`` бит - номер текущего вопроса, дальше по ``ANSWER_BITS`` бит
+на каждый ответ. Пять ответов 1-5 и номер вопроса умещаются в 20 бит.
+
+``SessionManager`` помнит время последнего ответа в каждом начатом опросе
+(обработчики опроса вызывают ``touch`` и ``finish``) и периодически
+завершает опросы, неактивные дольше ``idle_ttl``, а при превышении лимита
+числа сессий или памяти - самые давние из тех, что простаивают хотя бы
+``min_idle``. У завершенной сессии удаляются ``user_data`` и запись
+разговора - из памяти и из хранилища. ``finish`` тоже удаляет ``user_data``:
+после опроса данные пользователя хранить незачем.
+"""
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUIZ_KEY = 'quiz'
+# Какой опрос и какой его версии проходит пользователь: "id@version"
+QUIZ_REF_KEY = 'quiz_ref'
+INDEX_BITS = 5
+ANSWER_BITS = 3
+INDEX_MASK = (1 << INDEX_BITS) - 1
+ANSWER_MASK = (1 << ANSWER_BITS) - 1
+# Сколько вопросов и какой максимальный балл помещается в упакованное состояние
+MAX_QUESTIONS = INDEX_MASK
+MAX_SCORE = ANSWER_MASK
+# Оценка объема одной сессии до первого замера
+DEFAULT_SESSION_BYTES = 512
+
+
+def has_quiz_state(user_data):
+    """Есть ли в ``user_data`` начатый опрос (в том числе в старом формате)."""
+    return QUIZ_KEY in user_data or 'answers' in user_data
+
+
+def end_conversation(conversation, key):
+    """Завершает разговор ``key`` так же, как ConversationHandler по END.
+
+    В python-telegram-bot 20 нет публичного способа сбросить чужой разговор,
+    поэтому запись удаляется из словаря обработчика напрямую. Словарь следит
+    за удалениями, и при следующем update_persistence запись удаляется и из
+    хранилища.
+    """
+    conversations = getattr(conversation, '_conversations', None)
+    if conversations is not None:
+        conversations.pop(key, None)
+
+
+def quiz_state(user_data):
+    """Упакованное состояние опроса; старый формат (список answers) переводится на лету."""
+    state = user_data.get(QUIZ_KEY)
+    if state is not None:
+        return state
+    state = 0
+    for score in user_data.get('answers', ()):
+        state = add_answer(state, score)
+    return state
+
+
+def store_quiz_state(user_data, state):
+    user_data[QUIZ_KEY] = state
+    # Ключи старого формата больше не нужны
+    user_data.pop('answers', None)
+    user_data.pop('current_question_index', None)
+
+
+def clear_quiz_state(user_data):
+    user_data.pop(QUIZ_KEY, None)
+    user_data.pop(QUIZ_REF_KEY, None)
+
+
+def question_index(state):
+    return state & INDEX_MASK
+
+
+def add_answer(state, score):
+    """Состояние после ответа ``score`` на текущий вопрос."""
+    index = question_index(state)
+    if index >= MAX_QUESTIONS or not 0 <= score <= MAX_SCORE:
+        raise ValueError(f"Answer {score} to question {index} does not fit the quiz state")
+    # Номер вопроса меньше INDEX_MASK, поэтому +1 не заденет биты ответов
+    return (state | score << (INDEX_BITS + ANSWER_BITS * index)) + 1
+
+
+def answers(state):
+    return [
+        (state >> (INDEX_BITS + ANSWER_BITS * i)) & ANSWER_MASK
+        for i in range(question_index(state))
+    ]
+
+
+def total_score(state):
+    return sum(answers(state))
+
+
+class SessionManager:
+    def __init__(self, idle_ttl=1800.0, max_sessions=50000, max_bytes=None, sweep_interval=30.0,
+                 min_idle=60.0, on_evicted=None):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.min_idle = min_idle
+        # Вызывается с (chat_id, user_id) для опроса, прерванного из-за лимитов
+        self.on_evicted = on_evicted
+        self._application = None
+        self._conversation = None
+        self._sessions = OrderedDict()  # (chat_id, user_id) -> время последнего ответа
+        self._task = None
+        self._session_bytes = DEFAULT_SESSION_BYTES
+        self.expired = 0
+        self.evicted = 0
+
+    @property
+    def live(self):
+        return len(self._sessions)
+
+    @property
+    def approx_bytes(self):
+        """Примерный объем сессий по последнему замеру среднего размера одной сессии."""
+        return int(self._session_bytes * len(self._sessions))
+
+    def attach(self, application, conversation=None):
+        self._application = application
+        self._conversation = conversation
+
+    def restore(self, keys):
+        """Берет под наблюдение разговоры, загруженные из хранилища при старте."""
+        now = time.monotonic()
+        for key in keys:
+            self._sessions.setdefault(tuple(key), now)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="session-sweeper")
+        logger.info(
+            f"Session manager started: idle TTL={self.idle_ttl:.0f}s, "
+            f"max sessions={self.max_sessions}, max bytes={self.max_bytes}"
+        )
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def touch(self, chat_id, user_id):
+        """Опрос пользователя начат или продолжен."""
+        key = (chat_id, user_id)
+        self._sessions[key] = time.monotonic()
+        self._sessions.move_to_end(key)
+
+    def finish(self, chat_id, user_id):
+        """Опрос завершен обработчиком: следить за ним и хранить данные пользователя больше не нужно."""
+        self._sessions.pop((chat_id, user_id), None)
+        if self._application is not None:
+            self._application.drop_user_data(user_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping sessions: {e}", exc_info=True)
+
+    def sweep(self, now=None):
+        """Завершает неактивные сессии и самые давние сверх лимитов."""
+        now = now or time.monotonic()
+        if self._sessions:
+            self._session_bytes = self._measure() / len(self._sessions)
+        limit = self.max_sessions
+        if self.max_bytes:
+            limit = min(limit, int(self.max_bytes // self._session_bytes))
+
+        expired = evicted = 0
+        while self._sessions:
+            key, last_seen = next(iter(self._sessions.items()))
+            idle = now - last_seen
+            if idle >= self.idle_ttl:
+                expired += 1
+            elif len(self._sessions) > limit and idle >= self.min_idle:
+                # Сессии упорядочены по активности: если самая давняя еще
+                # отвечает, остальные тем более - лимит превышен временно
+                evicted += 1
+                if self.on_evicted is not None:
+                    self.on_evicted(*key)
+            else:
+                break
+            del self._sessions[key]
+            self._end(key)
+
+        if expired:
+            self.expired += expired
+            logger.info(f"Sessions: {expired} expired, {len(self._sessions)} live")
+        if evicted:
+            self.evicted += evicted
+            logger.warning(
+                f"Sessions: {evicted} quizzes ended over the limit of {limit}, {len(self._sessions)} live"
+            )
+
+    def _end(self, key):
+        if self._conversation is not None:
+            end_conversation(self._conversation, key)
+        if self._application is not None:
+            self._application.drop_user_data(key[1])
+
+    def _measure(self):
+        """Примерный объем памяти сессий: user_data и запись о последней активности."""
+        user_data = self._application.user_data if self._application else {}
+        total = sys.getsizeof(self._sessions)
+        for chat_id, user_id in self._sessions:
+            total += 100  # запись OrderedDict: ключ-кортеж, два int и float
+            data = user_data.get(user_id)
+            if data:
+                total += sys.getsizeof(data) + sum(
+                    sys.getsizeof(key) + sys.getsizeof(value) for key, value in data.items()
+                )
+        return total
+
+    def stats(self):
+        return {
+            "live": len(self._sessions),
+            "approx_bytes": self.approx_bytes,
+            "idle_ttl": self.idle_ttl,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
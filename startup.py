@@ -0,0 +1,55 @@
+"""Кэш конфигурации бота на диске для быстрого холодного старта.
+
+После регистрации вебхука в JSON-файл записываются его параметры и данные
+бота из ``getMe``. При следующем старте по ним можно понять, что вебхук уже
+настроен как нужно, и не регистрировать его заново. Токен и секрет в файл
+не пишутся - только их отпечатки; кэш другого токена игнорируется.
+"""
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(value):
+    return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+
+class StartupCache:
+    def __init__(self, path, token):
+        self.path = path
+        self.token_fingerprint = fingerprint(token)
+        self.data = {}
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable startup cache {self.path}: {e}")
+            return self
+        if data.get("token") != self.token_fingerprint:
+            logger.info("Startup cache belongs to another bot token, ignoring it")
+            return self
+        self.data = data
+        return self
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def save(self):
+        self.data["token"] = self.token_fingerprint
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w") as file:
+                json.dump(self.data, file, ensure_ascii=False)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save startup cache {self.path}: {e}")
@@ -0,0 +1,321 @@
+"""Постоянное хранилище состояния опросов с отложенной записью.
+
+``WriteBehindPersistence`` подключается к ``Application`` как обычная
+persistence из python-telegram-bot, но:
+
+* изменения копятся в памяти и сбрасываются в хранилище пачками - по
+  таймеру или когда накопилось ``batch_size`` записей, одной транзакцией;
+* ``user_data`` не читается целиком при старте, а подгружается по одному
+  пользователю при первом его обновлении;
+* весь ввод-вывод идет в отдельном потоке, event loop не блокируется.
+
+Хранилище подключаемое: ``SQLiteBackend`` (по умолчанию) или ``MemoryBackend``.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Маркер удаления записи в буфере
+_DELETED = object()
+# Потолок паузы между повторами после ошибок записи, секунд
+MAX_RETRY_DELAY = 60.0
+
+
+def _encode_key(key):
+    return json.dumps(list(key))
+
+
+def _decode_key(raw):
+    return tuple(json.loads(raw))
+
+
+class MemoryBackend:
+    """Хранилище в памяти процесса - для разработки и тестов."""
+
+    def __init__(self):
+        self._users = {}
+        self._conversations = {}
+
+    def load_user(self, user_id):
+        return self._users.get(user_id)
+
+    def load_conversations(self, name):
+        return dict(self._conversations.get(name, {}))
+
+    def write_batch(self, users, conversations):
+        for user_id, data in users.items():
+            if data is _DELETED:
+                self._users.pop(user_id, None)
+            else:
+                self._users[user_id] = data
+        for (name, key), state in conversations.items():
+            states = self._conversations.setdefault(name, {})
+            if state is None:
+                states.pop(key, None)
+            else:
+                states[key] = state
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Локальный файл SQLite. Все методы вызываются из одного потока."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_data ("
+                "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL, "
+                "PRIMARY KEY (name, key))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def load_user(self, user_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_conversations(self, name):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {_decode_key(key): json.loads(state) for key, state in rows}
+
+    def write_batch(self, users, conversations):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?",
+                    [(user_id,) for user_id, data in users.items() if data is _DELETED]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                    [(user_id, json.dumps(data, ensure_ascii=False))
+                     for user_id, data in users.items() if data is not _DELETED]
+                )
+                conn.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    [(name, _encode_key(key))
+                     for (name, key), state in conversations.items() if state is None]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    [(name, _encode_key(key), json.dumps(state))
+                     for (name, key), state in conversations.items() if state is not None]
+                )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_backend(kind, path):
+    if kind == 'sqlite':
+        return SQLiteBackend(path)
+    if kind == 'memory':
+        return MemoryBackend()
+    raise ValueError(f"Unknown state backend: {kind}")
+
+
+class WriteBehindPersistence(BasePersistence):
+    def __init__(self, backend, flush_interval=2.0, batch_size=200, update_interval=5,
+                 loaded_users_limit=100000):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval
+        )
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        # Пользователи, чьи данные уже подгружены; самые давние забываются сверх лимита -
+        # повторная подгрузка не затирает данные в памяти
+        self._loaded_users = OrderedDict()
+        self.loaded_users_limit = max(1, loaded_users_limit)
+        self._restored_conversations = {}
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer = None
+        self._flush_tasks = set()
+        # Пауза перед следующей попыткой после ошибки записи; 0 - ошибок не было
+        self._retry_delay = 0.0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.records_written = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def stats(self):
+        return {
+            "loaded_users": len(self._loaded_users),
+            "pending_writes": len(self._pending_users) + len(self._pending_conversations),
+            "flushes": self.flushes,
+            "records_written": self.records_written,
+            "flush_errors": self.flush_errors,
+        }
+
+    # --- Загрузка ---
+
+    async def get_user_data(self):
+        # Данные пользователей подгружаются лениво в refresh_user_data
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # Хранятся только незавершенные разговоры: брошенные SessionManager завершает по
+        # SESSION_IDLE_TTL (загруженные здесь - тоже), и их записи удаляются
+        conversations = await self._run(self.backend.load_conversations, name)
+        self._restored_conversations[name] = list(conversations)
+        return conversations
+
+    def restored_conversations(self, name):
+        """Забирает ключи разговоров ``name``, загруженных из хранилища при старте."""
+        return self._restored_conversations.pop(name, [])
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            self._loaded_users.move_to_end(user_id)
+            return
+        pending = self._pending_users.get(user_id)
+        if pending is _DELETED:
+            stored = None
+        elif pending is not None:
+            stored = pending
+        else:
+            # Если чтение упадет, пользователь не считается загруженным и будет
+            # прочитан снова, а не затерт пустым словарем
+            stored = await self._run(self.backend.load_user, user_id)
+        if stored:
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+        self._mark_loaded(user_id)
+
+    def _mark_loaded(self, user_id):
+        self._loaded_users[user_id] = True
+        if len(self._loaded_users) > self.loaded_users_limit:
+            self._loaded_users.popitem(last=False)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- Запись ---
+
+    async def update_user_data(self, user_id, data):
+        # Пустой user_data (например, после завершения опроса) хранить незачем
+        self._pending_users[user_id] = data if data else _DELETED
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._pending_users[user_id] = _DELETED
+        self._loaded_users.pop(user_id, None)
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, key)] = new_state
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_flush(self):
+        pending = len(self._pending_users) + len(self._pending_conversations)
+        # После ошибки записи ждем таймера повтора, даже если пачка уже набралась
+        if pending >= self.batch_size and not self._retry_delay:
+            self._start_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self._retry_delay or self.flush_interval, self._start_flush
+            )
+
+    def _start_flush(self):
+        task = asyncio.get_running_loop().create_task(self._flush_pending())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_pending(self):
+        async with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            if not users and not conversations:
+                return True
+            try:
+                await self._run(self.backend.write_batch, users, conversations)
+            except Exception as e:
+                logger.error(f"Error flushing state store: {e}", exc_info=True)
+                # Возвращаем несохраненное в буфер, не затирая более свежие изменения
+                for user_id, data in users.items():
+                    self._pending_users.setdefault(user_id, data)
+                for key, state in conversations.items():
+                    self._pending_conversations.setdefault(key, state)
+                self.flush_errors += 1
+                self._retry_delay = min(max(self._retry_delay * 2, self.flush_interval), MAX_RETRY_DELAY)
+                self._schedule_flush()
+                return False
+            self._retry_delay = 0.0
+            self.flushes += 1
+            self.records_written += len(users) + len(conversations)
+            return True
+
+    async def commit(self):
+        """Сразу записывает накопленные изменения. True, если все записано."""
+        return await self._flush_pending()
+
+    async def flush(self):
+        await self._flush_pending()
+        await self._run(self.backend.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from analytics import QuizAnalytics, worker_snapshot_path
+
+QUIZ = SimpleNamespace(id="qa", title="QA", questions=["q1", "q2"])
+
+
+def complete(analytics, scores):
+    analytics.started(QUIZ)
+    for index, score in enumerate(scores):
+        analytics.answered(QUIZ, index, score)
+    analytics.completed(QUIZ, sum(scores))
+
+
+def test_report_counts_funnel_and_totals():
+    analytics = QuizAnalytics()
+    complete(analytics, [1, 2])
+    analytics.started(QUIZ)
+    analytics.invalid(QUIZ, 0)
+    report = analytics.report()["qa"]
+    assert report["started"] == 2
+    assert report["completed"] == 1
+    assert report["score_distribution"] == {3: 1}
+    assert report["questions"][0]["invalid"] == 1
+
+
+def test_peer_snapshots_are_merged_after_refresh(tmp_path):
+    base = str(tmp_path / "analytics.json")
+    other = QuizAnalytics(worker_snapshot_path(base, 1))
+    complete(other, [2, 2])
+    other.snapshot()
+
+    own_path = worker_snapshot_path(base, 0)
+    analytics = QuizAnalytics(own_path, peers=lambda: [other.path])
+    complete(analytics, [1, 1])
+    assert analytics.report()["qa"]["completed"] == 1
+
+    analytics.refresh_peers()
+    report = analytics.report()["qa"]
+    assert report["completed"] == 2
+    assert report["score_distribution"] == {2: 1, 4: 1}
+    # Свои счетчики продолжают расти и видны сразу
+    complete(analytics, [1, 1])
+    assert analytics.report()["qa"]["completed"] == 3
@@ -0,0 +1,21 @@
+import asyncio
+
+from broadcast import BroadcastEngine, BroadcastStore
+
+
+def test_recipients_are_flushed_by_timer_and_on_stop(tmp_path):
+    async def scenario():
+        store = BroadcastStore(str(tmp_path / "broadcast.sqlite3"))
+        engine = BroadcastEngine(store, None, flush_interval=0.01)
+        engine.add_recipient(1, "qa")
+        await asyncio.sleep(0.05)
+        recorded_by_timer = engine.recorded
+        engine.add_recipient(2, "qa")
+        await engine.stop()
+        return recorded_by_timer, engine
+
+    recorded_by_timer, engine = asyncio.run(scenario())
+    assert recorded_by_timer == 1
+    assert engine.recorded == 2
+    assert not engine._flush_tasks
+    assert BroadcastStore(str(tmp_path / "broadcast.sqlite3")).count_recipients() == 2
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from cache import AsyncTTLCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_gets_share_one_load():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        cache = AsyncTTLCache(default_ttl=60)
+        return await asyncio.gather(*(cache.get("key", loader) for _ in range(5)))
+
+    assert run(scenario()) == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_failed_load_without_value_raises():
+    async def loader():
+        raise RuntimeError("api is down")
+
+    async def scenario():
+        cache = AsyncTTLCache()
+        with pytest.raises(RuntimeError):
+            await cache.get("key", loader)
+        return cache
+
+    cache = run(scenario())
+    assert cache.errors == 1
+    assert cache.is_stale("key")
+
+
+def test_failed_refresh_serves_stale_value_for_error_ttl():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise RuntimeError("api is down")
+
+    async def scenario():
+        cache = AsyncTTLCache(default_ttl=0, error_ttl=60)
+        cache.put("key", "old")
+        first = await cache.get("key", failing)
+        second = await cache.get("key", failing)
+        return cache, first, second
+
+    cache, first, second = run(scenario())
+    assert (first, second) == ("old", "old")
+    # Вторая попытка не пошла в API: ключ свеж до истечения error_ttl
+    assert len(calls) == 1
+    assert not cache.is_stale("key")
+
+
+def test_invalidate_during_load_is_not_overwritten():
+    async def scenario():
+        cache = AsyncTTLCache(default_ttl=60)
+        release = asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            return "loaded before invalidate"
+
+        pending = asyncio.ensure_future(cache.get("key", loader))
+        await asyncio.sleep(0)
+        cache.invalidate("key")
+        release.set()
+        result = await pending
+        return cache, result
+
+    cache, result = run(scenario())
+    assert result == "loaded before invalidate"
+    assert cache.peek("key") == (None, None)
+
+
+def test_refresh_keeps_task_until_done_and_logs_failure(caplog):
+    async def loader():
+        await asyncio.sleep(0)
+        raise RuntimeError("api is down")
+
+    async def scenario():
+        cache = AsyncTTLCache()
+        cache.refresh("key", loader)
+        tracked = len(cache._refreshes)
+        await asyncio.sleep(0.01)
+        return cache, tracked
+
+    cache, tracked = run(scenario())
+    assert tracked == 1
+    assert not cache._refreshes
+    assert "Background cache refresh failed" in caplog.text
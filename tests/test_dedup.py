@@ -0,0 +1,30 @@
+from dedup import UpdateDeduplicator
+
+
+def test_duplicates_are_counted():
+    dedup = UpdateDeduplicator(capacity=4)
+    dedup.add(1)
+    assert dedup.is_duplicate(1)
+    assert not dedup.is_duplicate(2)
+    assert dedup.duplicates == 1
+
+
+def test_window_evicts_oldest():
+    dedup = UpdateDeduplicator(capacity=3)
+    for update_id in range(1, 5):
+        dedup.add(update_id)
+    assert 1 not in dedup
+    assert all(update_id in dedup for update_id in (2, 3, 4))
+
+
+def test_discard_rejected_update():
+    dedup = UpdateDeduplicator(capacity=3)
+    dedup.add(1)
+    dedup.add(2)
+    dedup.discard(1)
+    assert 1 not in dedup
+    # Повторно принятый идентификатор живет полный срок окна
+    dedup.add(1)
+    dedup.add(3)
+    dedup.add(4)
+    assert 1 in dedup and 2 not in dedup
@@ -0,0 +1,38 @@
+import threading
+
+from metrics import Registry
+
+
+def run_in_threads(func, count):
+    for _ in range(count):
+        thread = threading.Thread(target=func)
+        thread.start()
+        thread.join()
+
+
+def test_finished_threads_fold_into_base():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests")
+    histogram = registry.histogram("request_seconds", "Latency")
+
+    def record():
+        counter.inc()
+        histogram.observe(0.2)
+
+    run_in_threads(record, 500)
+
+    child = counter.labels()
+    assert child.value() == 500
+    assert len(child._values._shards) == 0
+    counts, total = histogram.labels().snapshot()
+    assert sum(counts) == 500
+    assert abs(total - 100.0) < 1e-6
+
+
+def test_live_thread_values_are_counted():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests")
+    counter.inc(3)
+    run_in_threads(counter.inc, 2)
+    assert counter.labels().value() == 5
+    assert "requests_total 5" in registry.render()
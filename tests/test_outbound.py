@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from outbound import PRIORITY_BROADCAST, PRIORITY_QUIZ, OutboundMessage, OutboundScheduler, _can_merge, _merge
+
+
+def message(text, priority=PRIORITY_QUIZ, **kwargs):
+    return OutboundMessage(1, 'send_message', dict(text=text, **kwargs), priority, None)
+
+
+def test_texts_with_same_priority_merge():
+    first, second = message("a"), message("b")
+    assert _can_merge(first, second)
+    _merge(first, second)
+    assert first.kwargs['text'] == "a\n\nb"
+    assert len(first.futures) == 2
+
+
+def test_broadcast_does_not_merge_with_quiz_reply():
+    assert not _can_merge(message("a"), message("b", PRIORITY_BROADCAST))
+    assert not _can_merge(message("a", PRIORITY_BROADCAST), message("b"))
+
+
+def test_different_preview_settings_do_not_merge():
+    assert not _can_merge(message("a"), message("b", disable_web_page_preview=True))
+
+
+class FloodedBot:
+    """Первые ``floods`` вызовов отвечают 429, остальные проходят."""
+
+    def __init__(self, floods):
+        self.floods = floods
+        self.sent = []
+
+    async def send_message(self, chat_id, **kwargs):
+        if self.floods:
+            self.floods -= 1
+            raise RetryAfter(1)
+        self.sent.append((chat_id, time.monotonic()))
+        return chat_id
+
+
+def test_floods_in_several_chats_pause_all_sends():
+    async def scenario():
+        bot = FloodedBot(floods=2)
+        outbound = OutboundScheduler(bot, global_rate=1000, chat_rate=1000, chat_burst=1000,
+                                     flood_chats=2, coalesce=False)
+        outbound.start()
+        flooded = [outbound.submit(chat_id, text="hi") for chat_id in (1, 2)]
+        await asyncio.sleep(0.05)
+        # Чат 3 лимит не получал, но тоже ждет общей паузы
+        started = time.monotonic()
+        await outbound.send(3, "hi")
+        waited = time.monotonic() - started
+        await asyncio.gather(*flooded)
+        await outbound.stop()
+        return outbound, waited
+
+    outbound, waited = asyncio.run(scenario())
+    assert outbound.global_pauses == 1
+    assert waited >= 0.8
+
+
+def test_single_chat_flood_does_not_pause_others():
+    async def scenario():
+        bot = FloodedBot(floods=1)
+        outbound = OutboundScheduler(bot, global_rate=1000, chat_rate=1000, chat_burst=1000,
+                                     flood_chats=2, coalesce=False)
+        outbound.start()
+        await asyncio.gather(*(outbound.send(chat_id, "hi") for chat_id in (1, 2)))
+        await outbound.stop()
+        return outbound
+
+    assert asyncio.run(scenario()).global_pauses == 0
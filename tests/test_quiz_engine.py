@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from quiz_engine import QuizDefinitionError, QuizRegistry, compile_quiz
+
+QUIZ_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "quizzes")
+
+
+def definition(**overrides):
+    data = {
+        "id": "demo",
+        "title": "Demo",
+        "questions": ["A", "B", "C", "D", "E"],
+        "scale": [{"label": f"{score} ⭐", "score": score} for score in range(1, 6)],
+        "results": [
+            {"min_score": 5, "text": "low"},
+            {"min_score": 15, "text": "mid"},
+            {"min_score": 21, "text": "high"},
+        ],
+    }
+    data.update(overrides)
+    return data
+
+
+def test_result_bands_start_at_lowest_reachable_total():
+    quiz = compile_quiz(definition(), "v1")
+    assert quiz.result_text(5) == "low"
+    assert quiz.result_text(14) == "low"
+    assert quiz.result_text(15) == "mid"
+    assert quiz.result_text(25) == "high"
+    # Вне диапазона - ближайший край таблицы
+    assert quiz.result_text(0) == "low"
+    assert quiz.result_text(99) == "high"
+
+
+def test_uncovered_reachable_totals_are_rejected():
+    with pytest.raises(QuizDefinitionError):
+        compile_quiz(definition(results=[{"min_score": 6, "text": "too high"}]), "v1")
+    with pytest.raises(QuizDefinitionError):
+        compile_quiz(definition(results=[]), "v1")
+
+
+def test_scale_scores_must_fit_packed_state():
+    with pytest.raises(QuizDefinitionError):
+        compile_quiz(definition(scale=[{"label": "x", "score": 8}]), "v1")
+
+
+def test_parse_answer():
+    quiz = compile_quiz(definition(), "v1")
+    assert quiz.parse_answer("3 ⭐") == 3
+    assert quiz.parse_answer("4") == 4
+    assert quiz.parse_answer("5 whatever") == 5
+    assert quiz.parse_answer("6") is None
+    assert quiz.parse_answer("²") is None
+    assert quiz.parse_answer("") is None
+    assert quiz.parse_answer("hello") is None
+
+
+def test_is_valid_score():
+    quiz = compile_quiz(definition(), "v1")
+    assert quiz.is_valid_score(1)
+    assert not quiz.is_valid_score(0)
+    assert not quiz.is_valid_score(7)
+
+
+def test_shipped_quiz_compiles():
+    registry = QuizRegistry(QUIZ_DIR, required=("qa",))
+    registry.load()
+    quiz = registry.get("qa")
+    assert quiz.ref == f"qa@{quiz.version}"
+    assert quiz.parse_answer(quiz.reply_markup.keyboard[0][0].text) is not None
+
+
+def test_broken_reload_keeps_current_set(tmp_path):
+    (tmp_path / "demo.json").write_text(json.dumps(definition()), encoding="utf-8")
+    registry = QuizRegistry(str(tmp_path), required=("demo",))
+    assert registry.load()
+    (tmp_path / "demo.json").write_text(
+        json.dumps(definition(results=[{"min_score": 10, "text": "x"}])), encoding="utf-8"
+    )
+    assert not registry.load()
+    assert registry.errors == 1
+    assert registry.get("demo").result_text(5) == "low"
@@ -0,0 +1,21 @@
+import pytest
+from telegram import KeyboardButton
+
+from routing import build_text_routes, keyboard_labels
+
+KEYBOARD = [[KeyboardButton("Start"), "About"], ["Health"]]
+
+
+def test_keyboard_labels_in_order():
+    assert keyboard_labels(KEYBOARD) == ["Start", "About", "Health"]
+
+
+def test_routes_skip_buttons_handled_elsewhere():
+    about, health = object(), object()
+    routes = build_text_routes(KEYBOARD, {"About": about, "Health": health}, handled_elsewhere=("Start",))
+    assert routes == {"About": about, "Health": health}
+
+
+def test_button_without_handler_is_an_error():
+    with pytest.raises(ValueError):
+        build_text_routes(KEYBOARD, {"About": object()}, handled_elsewhere=("Start",))
@@ -0,0 +1,58 @@
+import asyncio
+
+from scheduler import OVERFLOW_REJECT, ChatOrderedScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_updates_of_one_chat_keep_order():
+    async def scenario():
+        seen = []
+
+        async def handler(item):
+            await asyncio.sleep(0)
+            seen.append(item)
+
+        scheduler = ChatOrderedScheduler(handler, concurrency=4)
+        scheduler.start()
+        for i in range(10):
+            assert await scheduler.submit("chat", i)
+        assert await scheduler.drain(1.0)
+        await scheduler.stop()
+        return seen
+
+    assert run(scenario()) == list(range(10))
+
+
+def test_drain_times_out_while_busy():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(item):
+            await release.wait()
+
+        scheduler = ChatOrderedScheduler(handler, concurrency=1)
+        scheduler.start()
+        await scheduler.submit("chat", 1)
+        drained = await scheduler.drain(0.05)
+        release.set()
+        drained_later = await scheduler.drain(1.0)
+        await scheduler.stop()
+        return drained, drained_later
+
+    assert run(scenario()) == (False, True)
+
+
+def test_rejects_after_stop():
+    async def scenario():
+        async def handler(item):
+            pass
+
+        scheduler = ChatOrderedScheduler(handler, overflow_policy=OVERFLOW_REJECT)
+        scheduler.start()
+        await scheduler.stop()
+        return await scheduler.submit("chat", 1)
+
+    assert run(scenario()) is False
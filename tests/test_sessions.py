@@ -0,0 +1,106 @@
+import pytest
+
+from types import SimpleNamespace
+
+from sessions import SessionManager, add_answer, answers, has_quiz_state, question_index, total_score
+
+
+class FakeApplication:
+    def __init__(self):
+        self.user_data = {}
+        self.dropped = []
+
+    def drop_user_data(self, user_id):
+        self.user_data.pop(user_id, None)
+        self.dropped.append(user_id)
+
+
+def make_manager(conversation=None, **kwargs):
+    manager = SessionManager(**kwargs)
+    application = FakeApplication()
+    manager.attach(application, conversation)
+    return manager, application
+
+
+def test_packed_state_round_trip():
+    state = 0
+    for score in (1, 5, 3):
+        state = add_answer(state, score)
+    assert question_index(state) == 3
+    assert answers(state) == [1, 5, 3]
+    assert total_score(state) == 9
+
+
+def test_packed_state_rejects_score_out_of_range():
+    with pytest.raises(ValueError):
+        add_answer(0, 8)
+
+
+def test_idle_sessions_expire():
+    manager, application = make_manager(idle_ttl=10)
+    manager.touch(1, 1)
+    manager.touch(2, 2)
+    manager._sessions[(1, 1)] -= 20
+    manager.sweep()
+    assert manager.live == 1
+    assert manager.expired == 1
+    assert application.dropped == [1]
+
+
+def test_has_quiz_state():
+    assert not has_quiz_state({})
+    assert has_quiz_state({"quiz": 0})
+    assert has_quiz_state({"answers": [1, 2]})
+
+
+def test_finished_sessions_are_not_tracked():
+    manager, application = make_manager()
+    application.user_data[1] = {}
+    manager.touch(1, 1)
+    manager.finish(1, 1)
+    manager.sweep()
+    assert manager.live == 0
+    # Данные пользователя после опроса не держим
+    assert application.dropped == [1]
+    assert 1 not in application.user_data
+
+
+def test_expired_session_ends_conversation():
+    conversation = SimpleNamespace(_conversations={(1, 1): 0, (2, 2): 0})
+    manager, _ = make_manager(conversation, idle_ttl=10)
+    manager.touch(1, 1)
+    manager.touch(2, 2)
+    manager._sessions[(1, 1)] -= 20
+    manager.sweep()
+    assert conversation._conversations == {(2, 2): 0}
+
+
+def test_restored_conversations_expire():
+    manager, application = make_manager(idle_ttl=10)
+    manager.restore([[5, 5]])
+    assert manager.live == 1
+    manager.sweep(now=manager._sessions[(5, 5)] + 11)
+    assert manager.live == 0
+    assert application.dropped == [5]
+
+
+def test_approx_bytes_follow_live_sessions():
+    manager, _ = make_manager()
+    manager.touch(1, 1)
+    assert manager.approx_bytes > 0
+    manager.finish(1, 1)
+    assert manager.approx_bytes == 0
+
+
+def test_eviction_skips_recently_active_sessions():
+    evicted = []
+    manager, _ = make_manager(max_sessions=1, min_idle=60, on_evicted=lambda *key: evicted.append(key))
+    manager.touch(1, 1)
+    manager.touch(2, 2)
+    manager.sweep()
+    assert manager.live == 2
+
+    manager._sessions[(1, 1)] -= 120
+    manager.sweep()
+    assert manager.live == 1
+    assert evicted == [(1, 1)]
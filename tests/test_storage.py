@@ -0,0 +1,80 @@
+import asyncio
+
+from storage import MemoryBackend, WriteBehindPersistence
+
+
+class FailingBackend(MemoryBackend):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    def write_batch(self, users, conversations):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise OSError("disk is full")
+        super().write_batch(users, conversations)
+
+
+def test_failed_flush_backs_off_instead_of_retrying_at_once():
+    async def scenario():
+        backend = FailingBackend(failures=1)
+        persistence = WriteBehindPersistence(backend, flush_interval=0.05, batch_size=1)
+        await persistence.update_user_data(1, {"quiz": 1})
+        await asyncio.sleep(0.02)
+        attempts_after_failure = backend.attempts
+        # Пока идет пауза, новая полная пачка не запускает запись
+        await persistence.update_user_data(2, {"quiz": 1})
+        await asyncio.sleep(0.01)
+        attempts_during_backoff = backend.attempts
+        await asyncio.sleep(0.1)
+        return attempts_after_failure, attempts_during_backoff, backend, persistence
+
+    after_failure, during_backoff, backend, persistence = asyncio.run(scenario())
+    assert after_failure == 1
+    assert during_backoff == 1
+    assert backend.attempts == 2
+    assert persistence.flush_errors == 1
+    assert backend.load_user(2) == {"quiz": 1}
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+    async def scenario():
+        persistence = WriteBehindPersistence(FailingBackend(failures=10), flush_interval=1.0)
+        await persistence.update_user_data(1, {"quiz": 1})
+        delays = []
+        for _ in range(3):
+            await persistence.commit()
+            delays.append(persistence._retry_delay)
+        persistence._flush_timer.cancel()
+        return delays
+
+    assert asyncio.run(scenario()) == [1.0, 2.0, 4.0]
+
+
+class FlakyReadBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.fail_reads = 1
+
+    def load_user(self, user_id):
+        if self.fail_reads:
+            self.fail_reads -= 1
+            raise OSError("database is locked")
+        return super().load_user(user_id)
+
+
+def test_failed_user_load_is_retried():
+    async def scenario():
+        backend = FlakyReadBackend()
+        backend.write_batch({1: {"quiz": 3}}, {})
+        persistence = WriteBehindPersistence(backend)
+        user_data = {}
+        try:
+            await persistence.refresh_user_data(1, user_data)
+        except OSError:
+            pass
+        await persistence.refresh_user_data(1, user_data)
+        return user_data
+
+    assert asyncio.run(scenario()) == {"quiz": 3}
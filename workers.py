@@ -0,0 +1,261 @@
+"""Многопроцессный режим: фронт принимает вебхуки, воркеры их обрабатывают.
+
+Фронт раскладывает обновления по N процессам-воркерам по хешу ключа чата,
+поэтому все обновления одного чата попадают в один воркер и обрабатываются
+в порядке поступления. Каждый воркер - отдельный интерпретатор со своим
+``Application``; состояние опросов хранится в общем SQLite.
+
+Обновление остается у фронта, пока воркер его не подтвердит. Воркер
+подтверждает обработанные обновления пачкой и только после того, как их
+состояние записано в хранилище. Упавший воркер перезапускается, и фронт
+заново отправляет ему неподтвержденные обновления его шарда; остальные
+шарды при этом продолжают работать. Доставка "хотя бы один раз":
+обновление, обработанное перед самым падением, может прийти повторно.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# spawn, а не fork: у фронта уже работают event loop и потоки
+_context = multiprocessing.get_context('spawn')
+
+# Перезапуск воркера, упавшего вскоре после старта, откладывается все дольше
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+STABLE_UPTIME = 10.0
+
+
+class _Shard:
+    __slots__ = ("index", "process", "updates", "acks", "unacked",
+                 "restarts", "restart_delay", "started_at")
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.updates = None  # очередь фронт -> воркер
+        self.acks = None  # канал воркер -> фронт
+        self.unacked = OrderedDict()  # update_id -> обновление, в порядке отправки
+        self.restarts = 0
+        self.restart_delay = RESTART_DELAY
+        self.started_at = 0.0
+
+
+class ShardRouter:
+    """Фронт: распределяет обновления по воркерам и перезапускает упавших.
+
+    Интерфейс ``submit``/``stats`` такой же, как у ``ChatOrderedScheduler``,
+    поэтому прием вебхука не зависит от режима. ``target(index, updates, acks)``
+    запускается в каждом процессе-воркере. ``max_pending`` - лимит
+    неподтвержденных обновлений на один шард.
+    """
+
+    def __init__(self, target, workers, max_pending=1000, overflow_policy='wait', enqueue_timeout=2.0):
+        self._target = target
+        self._shards = [_Shard(index) for index in range(max(1, workers))]
+        self.max_pending = max(1, max_pending)
+        self.overflow_policy = overflow_policy
+        self.enqueue_timeout = enqueue_timeout
+        self._loop = None
+        self._space = None
+        self._closing = False
+        self.rejected = 0
+        # Фронт сам ничего не обрабатывает
+        self.in_flight = 0
+
+    @property
+    def pending(self):
+        return sum(len(shard.unacked) for shard in self._shards)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._space = asyncio.Event()
+        for shard in self._shards:
+            self._spawn(shard)
+        logger.info(f"Started {len(self._shards)} worker processes")
+
+    async def stop(self, timeout=10.0):
+        """Просит воркеров доработать очередь и завершиться."""
+        self._closing = True
+        for shard in self._shards:
+            if shard.acks is not None:
+                self._loop.remove_reader(shard.acks.fileno())
+            if shard.updates is not None:
+                shard.updates.put(None)
+        deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            if shard.process is None:
+                continue
+            remaining = max(0.0, deadline - time.monotonic())
+            await self._loop.run_in_executor(None, shard.process.join, remaining)
+            if shard.process.is_alive():
+                # SIGTERM воркеры игнорируют: их остановкой управляет фронт
+                logger.warning(f"Worker {shard.index} did not stop in time, killing it")
+                shard.process.kill()
+
+    async def submit(self, key, item):
+        shard = self._shards[hash(key) % len(self._shards)]
+        if len(shard.unacked) >= self.max_pending:
+            if self.overflow_policy != 'wait' or not await self._wait_for_space(shard):
+                self.rejected += 1
+                return False
+        json_data = item[0]
+        shard.unacked[json_data['update_id']] = item
+        # Пока воркер перезапускается, обновление ждет в unacked и уйдет при старте
+        if shard.updates is not None:
+            shard.updates.put(item)
+        return True
+
+    async def _wait_for_space(self, shard):
+        deadline = time.monotonic() + self.enqueue_timeout
+        while len(shard.unacked) >= self.max_pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def stats(self):
+        return {
+            "workers": len(self._shards),
+            "alive": sum(1 for shard in self._shards if shard.process and shard.process.is_alive()),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "restarts": sum(shard.restarts for shard in self._shards),
+            "shards": [
+                {
+                    "pid": shard.process.pid if shard.process else None,
+                    "pending": len(shard.unacked),
+                    "restarts": shard.restarts,
+                }
+                for shard in self._shards
+            ],
+        }
+
+    def _spawn(self, shard):
+        shard.updates = _context.Queue()
+        shard.acks, ack_writer = _context.Pipe(duplex=False)
+        shard.process = _context.Process(
+            target=self._target,
+            args=(shard.index, shard.updates, ack_writer),
+            name=f"bot-worker-{shard.index}",
+            daemon=True
+        )
+        shard.process.start()
+        shard.started_at = time.monotonic()
+        # Копия у фронта не нужна: когда воркер завершится, чтение вернет EOF
+        ack_writer.close()
+        self._loop.add_reader(shard.acks.fileno(), self._on_acks, shard)
+        for item in shard.unacked.values():
+            shard.updates.put(item)
+        logger.info(
+            f"Worker {shard.index} started (pid {shard.process.pid}), "
+            f"resent {len(shard.unacked)} unacknowledged updates"
+        )
+
+    def _on_acks(self, shard):
+        try:
+            update_ids = shard.acks.recv()
+        except (EOFError, OSError):
+            self._on_exit(shard)
+            return
+        for update_id in update_ids:
+            shard.unacked.pop(update_id, None)
+        self._space.set()
+
+    def _on_exit(self, shard):
+        self._loop.remove_reader(shard.acks.fileno())
+        shard.acks.close()
+        shard.acks = None
+        # Очередь могла остаться в неконсистентном состоянии - создается новая
+        shard.updates.cancel_join_thread()
+        shard.updates.close()
+        shard.updates = None
+        shard.process.join(timeout=1.0)
+        if shard.process.is_alive():
+            shard.process.kill()
+        if self._closing:
+            return
+
+        if time.monotonic() - shard.started_at >= STABLE_UPTIME:
+            shard.restart_delay = RESTART_DELAY
+        delay = shard.restart_delay
+        shard.restart_delay = min(MAX_RESTART_DELAY, shard.restart_delay * 2)
+        shard.restarts += 1
+        logger.error(
+            f"Worker {shard.index} exited with code {shard.process.exitcode}, "
+            f"restarting in {delay:.0f}s with {len(shard.unacked)} pending updates"
+        )
+        self._loop.call_later(delay, self._restart, shard)
+
+    def _restart(self, shard):
+        if not self._closing:
+            self._spawn(shard)
+
+
+class AckBatcher:
+    """Воркер: групповое подтверждение обработанных обновлений.
+
+    Раз в ``interval`` секунд вызывает ``commit()`` (сохранение состояния) и
+    только после его успеха отправляет фронту накопленные update_id.
+    """
+
+    def __init__(self, connection, commit, interval=0.2):
+        self._connection = connection
+        self._commit = commit
+        self.interval = interval
+        self._done = []
+
+    def done(self, update_id):
+        self._done.append(update_id)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._done:
+            return
+        batch, self._done = self._done, []
+        try:
+            await self._commit()
+        except Exception as e:
+            logger.error(f"Error committing worker state: {e}", exc_info=True)
+            # Не подтверждаем: при падении фронт пришлет эти обновления снова
+            self._done[:0] = batch
+            return
+        self._connection.send(batch)
+
+
+async def consume_updates(updates, submit):
+    """Воркер: читает обновления из очереди фронта до сигнала остановки (None)."""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-reader") as reader:
+        while True:
+            batch = await loop.run_in_executor(reader, _read_batch, updates)
+            for item in batch:
+                if item is None:
+                    return
+                await submit(item)
+
+
+def _read_batch(updates, limit=256):
+    """Ждет одно обновление и забирает уже пришедшие, чтобы не переключать потоки на каждое."""
+    batch = [updates.get()]
+    while len(batch) < limit and batch[-1] is not None:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch